@@ -2,12 +2,14 @@
 from .som import Som
 from .plsom import PLSom
 from .ng import Ng
-from .sequential import RecursiveSom, RecursiveNg
+from .sequential import RecursiveSom, RecursiveNg, MergeSom, MergeNg
 from .miikkulainen import MiikkulainenSom
 
 __all__ = ['Som',
            'Ng',
            'RecursiveSom',
            'RecursiveNg',
+           'MergeSom',
+           'MergeNg',
            'PLSom',
            'MiikkulainenSom']
@@ -3,13 +3,24 @@ import numpy as np
 import logging
 import time
 import types
-import json
+import os
 
 from tqdm import tqdm
-from .components.utilities import shuffle
 from .components.initializers import range_initialization
-from .dist import euclidean
+from .components.distance import euclidean_distance
+from .components.influence import InfluenceCache
+from .components.index import BmuIndex
+from .components.parallel import DataParallel
+from .components.data import load_data, in_memory, ScaledData
+from .components.serialization import read_model, write_model, is_binary
+from .components.utilities import Scaler
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .dist import euclidean
+except ImportError:
+    from .components.distance import euclidean
 
 
 logger = logging.getLogger(__name__)
@@ -44,6 +55,10 @@ class Base(object):
         An initialized instance of Scaler() which is used to scale the data
         to have mean 0 and stdev 1. If this is set to None, the SOM will
         create a scaler.
+    dtype : numpy dtype, optional, default np.float64
+        The dtype of the weights. The data, influences, scaler statistics
+        and all outputs are kept in this dtype, e.g. np.float32 halves the
+        memory use, and speeds up the matrix multiplications.
 
     Attributes
     ----------
@@ -53,6 +68,12 @@ class Base(object):
         The weight matrix.
     param_names : set
         The parameter names. Used in saving.
+    influence_cache : InfluenceCache
+        The cache of influences, keyed on the rounded neighborhood value.
+        Can be replaced by an InfluenceCache with a different size.
+    index : BmuIndex
+        The index over the weights, see build_index. None if no index
+        has been built since the last fit.
 
     """
 
@@ -62,7 +83,11 @@ class Base(object):
                    'data_dimensionality',
                    'params',
                    'valfunc',
-                   'argfunc'}
+                   'argfunc',
+                   'dtype'}
+
+    # Whether fit can divide batches over multiple processes.
+    parallel_training = True
 
     def __init__(self,
                  num_neurons,
@@ -71,12 +96,15 @@ class Base(object):
                  argfunc="argmin",
                  valfunc="min",
                  initializer=range_initialization,
-                 scaler=None):
+                 scaler=None,
+                 dtype=np.float64):
         """Organize nothing."""
-        self.num_neurons = np.int(num_neurons)
+        self.num_neurons = int(num_neurons)
         self.data_dimensionality = data_dimensionality
+        self.dtype = np.dtype(dtype)
         if self.data_dimensionality:
-            self.weights = np.zeros((num_neurons, data_dimensionality))
+            self.weights = np.zeros((num_neurons, data_dimensionality),
+                                    dtype=self.dtype)
         else:
             self.weights = None
         self.argfunc = argfunc
@@ -86,6 +114,13 @@ class Base(object):
         self.initializer = initializer
         self.params = params
         self.scaler = scaler
+        self.influence_cache = InfluenceCache()
+        self.index = None
+        self.parallel = None
+        self._stream = None
+        # Whether the weights are in the space of the scaled data, which is
+        # only the case during training.
+        self._weights_scaled = False
 
     def fit(self,
             X,
@@ -95,14 +130,23 @@ class Base(object):
             batch_size=1,
             show_progressbar=False,
             show_epoch=False,
-            refit=True):
+            refit=True,
+            precompute_influence=False,
+            n_jobs=1,
+            checkpoint=None,
+            checkpoint_epochs=None,
+            checkpoint_seconds=None,
+            resume_from=None):
         """
         Fit the learner to some data.
 
         Parameters
         ----------
-        X : numpy array.
-            The input data.
+        X : numpy array, np.memmap, str or list of numpy arrays
+            The input data. Data which is not in memory, i.e. a np.memmap,
+            the path to a .npy file, which is memory-mapped, or a list of
+            2D chunks, is read and scaled one batch at a time. Only the
+            indices of the data are shuffled.
         num_epochs : int, optional, default 10
             The number of epochs to train for.
         updates_epoch : int, optional, default 10
@@ -119,58 +163,350 @@ class Base(object):
             Whether to show a progressbar during training.
         show_epoch : bool, optional, default False
             Whether to print the epoch number to stdout
+        precompute_influence : bool, optional, default False
+            Whether to calculate the influence for the entire neighborhood
+            schedule before training, as far as it fits in the influence
+            cache.
+        n_jobs : int, optional, default 1
+            The number of processes to use. If this is more than 1, each
+            batch is divided over a pool of processes which share the data and
+            the weights. If this is -1, all cores are used.
+            batch_size should then be at least the number of processes.
+        checkpoint : str, optional, default None
+            The path of a .npz file to which the state of training is
+            written, so that training can be resumed with resume_from.
+            Checkpoints are written at the end of an epoch.
+        checkpoint_epochs : int, optional, default None
+            Write a checkpoint every checkpoint_epochs epochs. If this and
+            checkpoint_seconds are both None, a checkpoint is written after
+            every epoch.
+        checkpoint_seconds : float, optional, default None
+            Write a checkpoint at the end of the first epoch which ends
+            at least checkpoint_seconds after the previous checkpoint.
+        resume_from : str, optional, default None
+            The path of a checkpoint to resume training from. The weights,
+            parameters, schedule, epoch and random state are restored, so
+            the result is the same as that of an uninterrupted run. The
+            schedule arguments, i.e. num_epochs, updates_epoch and
+            stop_param_updates, are taken from the checkpoint, and refit is
+            ignored. X should be the same data as in the interrupted run.
 
         """
+        if n_jobs != 1 and not self.parallel_training:
+            raise ValueError("{0} can only be trained in a single "
+                             "process.".format(type(self).__name__))
+        # Fitting ends any stream of partial_fit calls.
+        self._stream = None
+
+        X = load_data(X)
+        if n_jobs != 1 and not in_memory(X):
+            raise ValueError("Data which is not in memory can only be "
+                             "trained on in a single process.")
+
         if self.data_dimensionality is None:
             self.data_dimensionality = X.shape[-1]
             self.weights = np.zeros((self.num_neurons,
-                                     self.data_dimensionality))
+                                     self.data_dimensionality),
+                                    dtype=self.dtype)
+        if checkpoint is not None and not is_binary(checkpoint):
+            raise ValueError("Checkpoints are written in the binary format, "
+                             "so the path should end with .npz, got "
+                             "{0}".format(checkpoint))
+        if checkpoint is not None:
+            missing = sorted(x for x in self.param_names
+                             if not hasattr(self, x))
+            if missing:
+                raise ValueError("{0} can not be checkpointed, it has no "
+                                 "{1}".format(type(self).__name__,
+                                              ", ".join(missing)))
+        if checkpoint_epochs is None and checkpoint_seconds is None:
+            checkpoint_epochs = 1
+
         X = self._check_input(X)
-        if not self.trained or refit:
-            X = self._init_weights(X)
+        if resume_from is not None:
+            schedule = self._load_checkpoint(resume_from)
+            num_epochs = schedule['num_epochs']
+            updates_epoch = schedule['updates_epoch']
+            constants = schedule['constants']
+            start_epoch = schedule['epoch']
+            X = self._scale(X)
         else:
-            if self.scaler is not None:
-                self.weights = self.scaler.transform(self.weights)
+            if not self.trained or refit:
+                X = self._init_weights(X)
+            else:
+                self._transform_weights()
+                X = self._scale(X)
+
+            if updates_epoch is None:
+                X_len = X.shape[0]
+                updates_epoch = np.min([50, X_len // batch_size])
 
-        if updates_epoch is None:
-            X_len = X.shape[0]
-            updates_epoch = np.min([50, X_len // batch_size])
+            constants = self._pre_train(stop_param_updates,
+                                        num_epochs,
+                                        updates_epoch)
+            start_epoch = 0
+
+        if precompute_influence and 'infl' in constants:
+            self._precompute_influences(constants['infl'],
+                                        num_epochs * (updates_epoch + 1))
+        if n_jobs != 1:
+            self.parallel = DataParallel(self, X, n_jobs)
 
-        constants = self._pre_train(stop_param_updates,
-                                    num_epochs,
-                                    updates_epoch)
         start = time.time()
-        for epoch in range(num_epochs):
-            if show_epoch:
-                print("Epoch {0} of {1}".format(epoch+1, num_epochs))
-            logger.info("Epoch {0} of {1}".format(epoch, num_epochs))
-
-            self._epoch(X,
-                        epoch,
-                        batch_size,
-                        updates_epoch,
-                        constants,
-                        show_progressbar)
+        last_checkpoint = start
+        try:
+            for epoch in range(start_epoch, num_epochs):
+                if show_epoch:
+                    print("Epoch {0} of {1}".format(epoch+1, num_epochs))
+                logger.info("Epoch {0} of {1}".format(epoch, num_epochs))
+
+                self._epoch(X,
+                            epoch,
+                            batch_size,
+                            updates_epoch,
+                            constants,
+                            show_progressbar)
+
+                if checkpoint is None:
+                    continue
+                due = (checkpoint_epochs is not None
+                       and (epoch + 1) % checkpoint_epochs == 0)
+                if checkpoint_seconds is not None:
+                    due |= time.time() - last_checkpoint >= checkpoint_seconds
+                if due:
+                    self._save_checkpoint(checkpoint,
+                                          epoch + 1,
+                                          num_epochs,
+                                          updates_epoch,
+                                          constants)
+                    last_checkpoint = time.time()
+        finally:
+            if self.parallel is not None:
+                self.parallel.close()
+                self.parallel = None
 
         self.trained = True
-        if self.scaler is not None:
-            self.weights = self.scaler.inverse_transform(self.weights)
+        self.index = None
+        self._inverse_transform_weights()
         logger.info("Total train time: {0}".format(time.time() - start))
 
+    def partial_fit(self,
+                    X,
+                    batch_size=1,
+                    num_updates=None,
+                    show_progressbar=False):
+        """
+        Train on a single chunk of data, continuing from previous calls.
+
+        This can be used to train on a stream of data. The first call starts
+        the stream: if the model has not been trained yet, the scaler is fit
+        and the weights are initialized on the first chunk. Otherwise,
+        training continues from the current weights and parameters, e.g.
+        after fit or load. Later calls keep the weights, the scaler and the
+        parameters, and only scale the new chunk.
+
+        The chunk is processed in order, and the parameters are updated once
+        per batch. Calling fit ends the stream.
+
+        Parameters
+        ----------
+        X : numpy array, np.memmap, str or list of numpy arrays
+            The chunk of data.
+        batch_size : int, optional, default 1
+            The batch size to use.
+        num_updates : int, optional, default None
+            The number of updates over which the parameters are decayed,
+            i.e. the expected number of batches in the stream. After this
+            many updates, the parameters stay constant. If this is None, the
+            parameters are never decayed. Only used by the first call.
+        show_progressbar : bool, optional, default False
+            Whether to show a progressbar.
+
+        """
+        X = load_data(X)
+        if self.data_dimensionality is None:
+            self.data_dimensionality = X.shape[-1]
+            self.weights = np.zeros((self.num_neurons,
+                                     self.data_dimensionality),
+                                    dtype=self.dtype)
+        X = self._check_input(X)
+
+        if self._stream is None:
+            if not self.trained:
+                X = self._init_weights(X)
+            else:
+                self._transform_weights()
+                X = self._scale(X)
+
+            constants = {}
+            if num_updates is not None:
+                constants = self._pre_train({}, 1, num_updates)
+            # The scaled weights are kept, so that they are not scaled back
+            # and forth on every call.
+            self._stream = {'weights': self.weights,
+                            'constants': constants,
+                            'num_updates': num_updates or 0,
+                            'updates': 0}
+        else:
+            self.weights = self._stream['weights']
+            self._weights_scaled = True
+            X = self._scale(X)
+
+        self._partial_epoch(X, batch_size, show_progressbar)
+
+        self._stream['weights'] = self.weights
+        self.trained = True
+        self.index = None
+        self._inverse_transform_weights()
+
+    def _partial_epoch(self, X, batch_size, show_progressbar):
+        """Train on a chunk in order, updating the params once per batch."""
+        stream = self._stream
+        batches = self._create_index_batches(len(X),
+                                             batch_size,
+                                             shuffle_data=False)
+
+        for index in tqdm(batches, disable=not show_progressbar):
+            if stream['updates'] < stream['num_updates']:
+                influences = self._update_params(stream['constants'])
+                stream['updates'] += 1
+            else:
+                influences = self._current_influence()
+
+            self._propagate(X[index], influences, indices=index)
+
+    def _save_checkpoint(self,
+                         path,
+                         epoch,
+                         num_epochs,
+                         updates_epoch,
+                         constants):
+        """
+        Write the state of training to a checkpoint.
+
+        The weights are saved as they are during training, i.e. scaled.
+        The previous checkpoint is only replaced once the new one has been
+        written completely, so that an interruption while writing never
+        leaves a broken checkpoint.
+
+        Parameters
+        ----------
+        path : str
+            The path of the checkpoint.
+        epoch : int
+            The epoch at which to resume.
+        num_epochs : int
+            The total number of epochs.
+        updates_epoch : int
+            The number of parameter updates per epoch.
+        constants : dict
+            The constants with which the parameters are updated.
+
+        """
+        arrays = {x: self.__getattribute__(x) for x in self.param_names
+                  if isinstance(self.__getattribute__(x), np.ndarray)}
+        if self.scaler is not None and self.scaler.is_fit:
+            arrays['scaler_mean'] = self.scaler.mean
+            arrays['scaler_std'] = self.scaler.std
+
+        name, keys, position, has_gauss, cached_gaussian = \
+            np.random.get_state()
+        arrays['random_keys'] = keys
+
+        attributes = {'params': self.params,
+                      'constants': constants,
+                      'epoch': epoch,
+                      'num_epochs': num_epochs,
+                      'updates_epoch': updates_epoch,
+                      'random_state': [name,
+                                       position,
+                                       has_gauss,
+                                       cached_gaussian]}
+
+        write_model(path, arrays, attributes)
+        logger.info("Wrote checkpoint for epoch {0} to {1}".format(epoch,
+                                                                   path))
+
+    def _load_checkpoint(self, path):
+        """
+        Restore the state of training from a checkpoint.
+
+        Parameters
+        ----------
+        path : str
+            The path of the checkpoint.
+
+        Returns
+        -------
+        schedule : dict
+            The epoch at which to resume, the total number of epochs,
+            the number of updates per epoch, and the constants.
+
+        """
+        data = read_model(path, mmap=False)
+
+        for x in self.param_names:
+            if x in data and isinstance(data[x], np.ndarray):
+                self.__setattr__(x, data[x].astype(self.dtype))
+        self.params = data['params']
+        self._load_scaler(data)
+        # The weights are saved as they are during training.
+        self._weights_scaled = True
+
+        name, position, has_gauss, cached_gaussian = data['random_state']
+        np.random.set_state((name,
+                             data['random_keys'],
+                             position,
+                             has_gauss,
+                             cached_gaussian))
+
+        return {x: data[x] for x in ('epoch',
+                                     'num_epochs',
+                                     'updates_epoch',
+                                     'constants')}
+
     def _init_weights(self,
                       X):
         """Set the weights and normalize data before starting training."""
-        X = np.asarray(X, dtype=np.float64)
-
         if self.scaler is not None:
-            X = self.scaler.fit_transform(X)
+            self.scaler.fit(X, dtype=self.dtype)
+        X = self._scale(X)
 
         if self.initializer is not None:
-            self.weights = self.initializer(X, self.num_neurons)
+            weights = self.initializer(X, self.num_neurons)
+            self.weights = np.asarray(weights, dtype=self.dtype)
 
         for v in self.params.values():
             v['value'] = v['orig']
+        self._weights_scaled = True
+
+        return X
+
+    def _transform_weights(self):
+        """Scale the weights to the space of the scaled data."""
+        if self.scaler is not None:
+            self.weights = self.scaler.transform(self.weights)
+        self._weights_scaled = True
+
+    def _inverse_transform_weights(self):
+        """Scale the weights back to the space of the data."""
+        if self.scaler is not None:
+            self.weights = self.scaler.inverse_transform(self.weights)
+        self._weights_scaled = False
+
+    def _scale(self, X):
+        """
+        Convert the data to the dtype of the model and scale it.
+
+        Data which is in memory is scaled in a single copy. Other data is
+        wrapped, so that each batch is scaled when it is read.
+        """
+        if not in_memory(X):
+            return ScaledData(X, self.scaler, self.dtype)
 
+        X = np.array(X, dtype=self.dtype)
+        if self.scaler is not None:
+            self.scaler.transform(X, out=X)
         return X
 
     def _pre_train(self,
@@ -261,81 +597,119 @@ class Base(object):
             Whether to show a progressbar during training.
 
         """
-        # Create batches
-        X_ = self._create_batches(X, batch_size)
-        X_len = np.prod(X.shape[:-1])
+        if self.parallel is not None and batch_size < self.parallel.n_jobs:
+            raise ValueError("Each batch is divided over the processes, so "
+                             "batch_size should be at least n_jobs, got "
+                             "{0} < {1}".format(batch_size,
+                                                self.parallel.n_jobs))
+
+        # Create batches of indices, so that only a single batch of the
+        # data is copied at a time.
+        batches = self._create_index_batches(len(X), batch_size)
 
-        update_step = np.ceil(X_.shape[0] / updates_epoch)
+        update_step = np.ceil(len(batches) / updates_epoch)
 
-        # Initialize the previous activation
-        prev = self._init_prev(X_)
         influences = self._update_params(constants)
 
         # Iterate over the training data
-        for idx, x in enumerate(tqdm(X_, disable=not show_progressbar)):
-
-            # Our batches are padded, so we need to
-            # make sure we know when we hit the padding
-            # so we don't inadvertently learn zeroes.
-            diff = X_len - (idx * batch_size)
-            if diff and diff < batch_size:
-                x = x[:diff]
-                # Prev_activation may be None
-                if prev is not None:
-                    prev = prev[:diff]
+        for idx, index in enumerate(tqdm(batches,
+                                         disable=not show_progressbar)):
 
             # If we hit an update step, perform an update.
             if idx % update_step == 0:
                 influences = self._update_params(constants)
                 logger.info(self.params)
 
-            prev = self._propagate(x,
-                                   influences,
-                                   prev_activation=prev)
+            if self.parallel is not None:
+                self.parallel.propagate(index)
+            else:
+                self._propagate(X[index],
+                                influences,
+                                indices=index)
+
+    def _precompute_influences(self, constant, num_updates):
+        """
+        Fill the influence cache with the neighborhood schedule.
+
+        Parameters
+        ----------
+        constant : float
+            The constant with which the neighborhood is multiplied in each
+            update step.
+        num_updates : int
+            The number of update steps to precompute.
+
+        """
+        cache = self.influence_cache
+        value = self.params['infl']['value']
+        for _ in range(num_updates):
+            value *= constant
+            if value in cache:
+                continue
+            influence = self._calculate_influence(cache.quantize(value))
+            # Stop if the influence would evict the ones we need first.
+            if influence.nbytes > cache.max_bytes - cache.nbytes:
+                logger.info("Influence cache full: precomputed "
+                            "{0} influences".format(len(cache)))
+                break
+            cache.put(value, influence)
 
     def _update_params(self, constants):
         """Update params and return new influence."""
         for k, v in constants.items():
             self.params[k]['value'] *= v
 
-        influence = self._calculate_influence(self.params['infl']['value'])
+        return self._current_influence()
+
+    def _current_influence(self):
+        """Get the influence for the current values of the params."""
+        influence = self._get_influence(self.params['infl']['value'])
         return influence * self.params['lr']['value']
 
-    def _init_prev(self, x):
-        """Initialize recurrent SOMs."""
-        return None
+    def _get_influence(self, neighborhood):
+        """Get the influence for a neighborhood value from the cache."""
+        return self.influence_cache.get(neighborhood,
+                                        self._calculate_influence)
 
     def _get_bmu(self, activations):
         """Get bmu based on activations."""
         return activations.__getattribute__(self.argfunc)(1)
 
-    def _create_batches(self, X, batch_size, shuffle_data=True):
+    def _create_index_batches(self, num_items, batch_size, shuffle_data=True):
         """
-        Create batches out of a sequence of data.
+        Create batches of indices into the data.
 
-        This function will append zeros to the end of your data to ensure that
-        all batches are even-sized. These are masked out during training.
-        """
-        if shuffle_data:
-            X = shuffle(X)
+        The last batch is smaller if num_items is not divisible by
+        batch_size.
 
-        if batch_size > X.shape[0]:
-            batch_size = X.shape[0]
+        Parameters
+        ----------
+        num_items : int
+            The number of items in the data.
+        batch_size : int
+            The batch size.
+        shuffle_data : bool, optional, default True
+            Whether to shuffle the indices.
 
-        max_x = int(np.ceil(X.shape[0] / batch_size))
-        X = np.resize(X, (max_x, batch_size, X.shape[-1]))
+        Returns
+        -------
+        batches : list of numpy arrays
+            A list of arrays of indices.
 
-        return X
+        """
+        if shuffle_data:
+            indices = np.random.permutation(num_items)
+        else:
+            indices = np.arange(num_items)
+
+        return [indices[idx:idx+batch_size]
+                for idx in range(0, num_items, batch_size)]
 
     def _propagate(self, x, influences, **kwargs):
         """Propagate a single batch of examples through the network."""
-        activation, difference_x = self.forward(x)
-        update = self.backward(difference_x, influences, activation)
-        # If batch size is 1 we can leave out the call to mean.
-        if update.shape[0] == 1:
-            self.weights += update[0]
-        else:
-            self.weights += update.mean(0)
+        activation = self.activate(x)
+        neurons, update = self.backward(x, influences, activation)
+        self.weights[neurons] += update
 
         return activation
 
@@ -362,31 +736,84 @@ class Base(object):
         """
         return self.distance_function(x, self.weights)
 
-    def backward(self, diff_x, influences, activations, **kwargs):
+    def activate(self, x, **kwargs):
+        """
+        Get the activations of the network, without the differences.
+
+        This is the forward pass used for inference: because no update
+        is calculated, the differences between the inputs and neurons are
+        never needed.
+
+        Parameters
+        ----------
+        x : numpy array.
+            The input vector.
+
+        Returns
+        -------
+        activations : numpy array
+            A (batch_size * neurons) matrix of activation values.
+
+        """
+        return self.distance(x, self.weights)
+
+    def backward(self, x, influences, activations, **kwargs):
         """
         Backward pass through the network, including update.
 
+        The mean update over the batch is calculated from two per-neuron
+        statistics: the influence-weighted sum of the inputs, and the summed
+        influence. Both are obtained by a matrix product with the influence
+        rows of the BMUs, so the (batch_size, neurons, dim) update tensor is
+        never created.
+
         Parameters
         ----------
-        diff_x : numpy array
-            A matrix containing the differences between the input and neurons.
-        influences : numpy array
-            A matrix containing the influence each neuron has on each
-            other neuron. This is used to calculate the updates.
+        x : numpy array
+            The input data.
+        influences : influence instance
+            An instance of one of the classes in somber.components.influence,
+            containing the influence each neuron has on each other neuron.
+            This is used to calculate the updates.
         activations : numpy array
             The activations each neuron has to each data point. This is used
             to calculate the BMU.
 
         Returns
         -------
+        neurons : slice or numpy array
+            The neurons to update.
         update : numpy array
-            A numpy array containing the updates to the neurons.
+            A numpy array containing the mean update to these neurons.
 
         """
         bmu = self._get_bmu(activations)
-        influence = influences[bmu]
-        update = np.multiply(diff_x, influence)
-        return update
+        return self._calculate_update(x, influences, bmu)
+
+    def _calculate_update(self, x, influences, bmu):
+        """
+        Calculate the mean update given the BMUs.
+
+        Parameters
+        ----------
+        x : numpy array
+            The input data.
+        influences : influence instance
+            The influence each neuron has on each other neuron.
+        bmu : numpy array
+            The BMU of each input, as returned by _get_bmu.
+
+        Returns
+        -------
+        neurons : slice or numpy array
+            The neurons to update.
+        update : numpy array
+            A numpy array containing the mean update to these neurons.
+
+        """
+        neurons, weighted_x, total = influences.statistics(bmu, x)
+        update = weighted_x - total[:, None] * self.weights[neurons]
+        return neurons, update / len(x)
 
     def distance_function(self, x, weights):
         """
@@ -411,6 +838,26 @@ class Base(object):
         """
         return euclidean(x, weights)
 
+    def distance(self, x, weights):
+        """
+        Calculate only the euclidean distance between input data and weights.
+
+        Parameters
+        ----------
+        x : numpy array.
+            The input data.
+        weights : numpy array.
+            The weights
+
+        Returns
+        -------
+        activations : numpy array
+            A (batch_size * neurons) matrix of activation values, containing
+            the response of each neuron to each input.
+
+        """
+        return euclidean_distance(x, weights)
+
     def _check_input(self, X):
         """
         Check the input for validity.
@@ -419,6 +866,7 @@ class Base(object):
         the second dimension of this matrix has the same dimensionality as
         the weight matrix.
         """
+        X = load_data(X)
         if np.ndim(X) == 1:
             X = np.reshape(X, (1, -1))
 
@@ -432,7 +880,12 @@ class Base(object):
                                                    self.data_dimensionality))
         return X
 
-    def transform(self, X, batch_size=100, show_progressbar=False):
+    def transform(self,
+                  X,
+                  batch_size=100,
+                  show_progressbar=False,
+                  n_jobs=1,
+                  out=None):
         """
         Transform input to a distance matrix by measuring the L2 distance.
 
@@ -445,6 +898,14 @@ class Base(object):
             transformation in stateful, i.e. sequential SOMs.
         show_progressbar : bool
             Whether to show a progressbar during transformation.
+        n_jobs : int, optional, default 1
+            The number of threads to use. The batches are divided over a
+            pool of threads, which can run in parallel because numpy
+            releases the GIL during matrix multiplication. If this is -1,
+            all cores are used.
+        out : numpy array, optional, default None
+            A (len(X), num_neurons) array to write the result to. If this
+            is None, a new array is allocated.
 
         Returns
         -------
@@ -455,33 +916,195 @@ class Base(object):
 
         """
         X = self._check_input(X)
+        out = self._check_output(X, out)
+
+        if n_jobs == 1:
+            return self._transform(X, batch_size, out, None, show_progressbar)
+
+        with ThreadPoolExecutor(self._num_threads(n_jobs)) as executor:
+            return self._transform(X,
+                                   batch_size,
+                                   out,
+                                   executor,
+                                   show_progressbar)
+
+    def _transform(self, X, batch_size, out, executor, show_progressbar):
+        """
+        Write the distance matrix of X to out, batch by batch.
+
+        If executor is None, the batches are processed in the current thread.
+        Otherwise, they are divided over the threads of the executor.
+        """
+        def transform_batch(idx):
+            out[idx:idx+batch_size] = self.activate(X[idx:idx+batch_size])
+
+        batches = range(0, len(X), batch_size)
+        if executor is None:
+            for idx in tqdm(batches, disable=not show_progressbar):
+                transform_batch(idx)
+        else:
+            for _ in tqdm(executor.map(transform_batch, batches),
+                          total=len(batches),
+                          disable=not show_progressbar):
+                pass
+
+        return out
+
+    @staticmethod
+    def _num_threads(n_jobs):
+        """Get the number of threads to use, where -1 means all cores."""
+        if n_jobs < 0:
+            return os.cpu_count()
+        return n_jobs
+
+    def _check_output(self, X, out):
+        """Create an output array for X, or check the given array."""
+        if out is None:
+            return np.empty((len(X), self.num_neurons), dtype=self.dtype)
+
+        if out.shape != (len(X), self.num_neurons):
+            raise ValueError("out has the wrong shape: {0}, expected "
+                             "{1}".format(out.shape,
+                                          (len(X), self.num_neurons)))
+        return out
+
+    def build_index(self, num_cells=None, num_probe=4, exact=True):
+        """
+        Build an index over the weights for finding BMUs.
 
-        batched = self._create_batches(X, batch_size, shuffle_data=False)
+        The index is used by predict, quantization_error and
+        invert_projection when use_index is True. If it was not built
+        explicitly, it is built with the default settings on first use.
+        Fitting the model again removes the index.
 
-        activations = []
-        prev = self._init_prev(batched)
+        Parameters
+        ----------
+        num_cells : int, optional, default None
+            The number of cells in the index. If this is None,
+            sqrt(num_neurons) cells are used.
+        num_probe : int, optional, default 4
+            The number of cells to search for each input. Higher values are
+            slower, but more accurate.
+        exact : bool, optional, default True
+            Whether to verify each result, and fall back to an exhaustive
+            search if it might be wrong. If this is True, the results are
+            identical to those without the index.
 
-        for x in tqdm(batched, disable=not show_progressbar):
-            prev = self.forward(x, prev_activation=prev)[0]
-            activations.extend(prev)
+        Returns
+        -------
+        index : BmuIndex
+            The index.
+
+        """
+        if self.argfunc != 'argmin':
+            raise ValueError("An index can only be used for models of which "
+                             "the BMU is the closest neuron.")
+        self.index = BmuIndex(self.weights, num_cells, num_probe, exact)
+        return self.index
+
+    def _query_index(self, X):
+        """Get the BMU and its distance for each input from the index."""
+        X = self._check_input(X)
+        if self.index is None:
+            self.build_index()
+        return self.index.query(X)
+
+    def iter_predict(self, X, chunk_size=1024, n_jobs=1):
+        """
+        Predict the BMU and its distance for each input, chunk by chunk.
+
+        Only a single (chunk_size, num_neurons) distance matrix is kept in
+        memory, which is reused for every chunk. This makes it possible to
+        predict large datasets, or to process the predictions as they
+        are produced.
+
+        Parameters
+        ----------
+        X : numpy array.
+            The input data.
+        chunk_size : int, optional, default 1024
+            The number of items per chunk.
+        n_jobs : int, optional, default 1
+            The number of threads over which each chunk is divided. A single
+            pool of threads is used for all chunks. See transform.
+
+        Yields
+        ------
+        bmu : numpy array
+            The BMU of each item in the chunk.
+        value : numpy array
+            The distance, or activation, of the BMU of each item in the chunk.
 
-        activations = np.asarray(activations, dtype=np.float64)
-        activations = activations[:X.shape[0]]
-        return activations.reshape(X.shape[0], self.num_neurons)
+        """
+        X = self._check_input(X)
+        n_jobs = self._num_threads(n_jobs)
+        batch_size = int(np.ceil(chunk_size / n_jobs))
+
+        buffer = np.empty((min(chunk_size, len(X)), self.num_neurons),
+                          dtype=self.dtype)
+        executor = ThreadPoolExecutor(n_jobs) if n_jobs != 1 else None
+        try:
+            for idx in range(0, len(X), chunk_size):
+                x = X[idx:idx+chunk_size]
+                dist = self._transform(x,
+                                       batch_size,
+                                       buffer[:len(x)],
+                                       executor,
+                                       False)
+                bmu = dist.__getattribute__(self.argfunc)(1)
+                yield bmu, dist[np.arange(len(x)), bmu]
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def _predict(self, X, batch_size, show_progressbar=False, n_jobs=1):
+        """
+        Get the BMU and its distance for each input.
 
-    def predict(self, X, batch_size=1, show_progressbar=False):
+        The distances are calculated in chunks of chunk_size items with
+        iter_predict. The batch size only matters for stateful models, so it
+        is not used here.
+        """
+        X = self._check_input(X)
+        bmu = np.empty(len(X), dtype=np.intp)
+        value = np.empty(len(X), dtype=self.dtype)
+
+        chunk_size = 1024
+        chunks = self.iter_predict(X, chunk_size, n_jobs)
+        for idx, (b, v) in enumerate(tqdm(chunks,
+                                          total=-(-len(X) // chunk_size),
+                                          disable=not show_progressbar)):
+            bmu[idx*chunk_size:(idx+1)*chunk_size] = b
+            value[idx*chunk_size:(idx+1)*chunk_size] = v
+
+        return bmu, value
+
+    def predict(self,
+                X,
+                batch_size=1,
+                show_progressbar=False,
+                use_index=False,
+                n_jobs=1):
         """
         Predict the BMU for each input data.
 
+        The data is processed in chunks using iter_predict, so the full
+        distance matrix is never created.
+
         Parameters
         ----------
         X : numpy array.
             The input data.
-        batch_size : int, optional, default 100
+        batch_size : int, optional, default 1
             The batch size to use in prediction. This may affect prediction
             in stateful, i.e. sequential SOMs.
         show_progressbar : bool
             Whether to show a progressbar during prediction.
+        use_index : bool, optional, default False
+            Whether to use the index over the weights instead of comparing
+            each input to all neurons. See build_index.
+        n_jobs : int, optional, default 1
+            The number of threads to use. See transform.
 
         Returns
         -------
@@ -489,12 +1112,12 @@ class Base(object):
             An array containing the BMU for each input data point.
 
         """
-        dist = self.transform(X, batch_size, show_progressbar)
-        res = dist.__getattribute__(self.argfunc)(1)
+        if use_index:
+            return self._query_index(X)[0]
 
-        return res
+        return self._predict(X, batch_size, show_progressbar, n_jobs)[0]
 
-    def quantization_error(self, X, batch_size=1):
+    def quantization_error(self, X, batch_size=1, use_index=False, n_jobs=1):
         """
         Calculate the quantization error.
 
@@ -507,6 +1130,11 @@ class Base(object):
             The input data.
         batch_size : int
             The batch size to use for processing.
+        use_index : bool, optional, default False
+            Whether to use the index over the weights instead of comparing
+            each input to all neurons. See build_index.
+        n_jobs : int, optional, default 1
+            The number of threads to use. See transform.
 
         Returns
         -------
@@ -514,10 +1142,10 @@ class Base(object):
             The error for each data point.
 
         """
-        dist = self.transform(X, batch_size)
-        res = dist.__getattribute__(self.valfunc)(1)
+        if use_index:
+            return self._query_index(X)[1]
 
-        return res
+        return self._predict(X, batch_size, n_jobs=n_jobs)[1]
 
     def receptive_field(self,
                         X,
@@ -591,14 +1219,17 @@ class Base(object):
         return rec
 
     @classmethod
-    def load(cls, path):
+    def load(cls, path, mmap=True):
         """
-        Load a SOM from a JSON file saved with this package.
+        Load a SOM from a file saved with this package.
 
         Parameters
         ----------
         path : str
-            The path to the JSON file.
+            The path to the JSON or .npz file.
+        mmap : bool, optional, default True
+            Whether to memory-map the arrays of a .npz file, instead of
+            reading them into memory.
 
         Returns
         -------
@@ -606,34 +1237,63 @@ class Base(object):
             A som of the specified class.
 
         """
-        data = json.load(open(path))
+        data = read_model(path, mmap)
 
         weights = data['weights']
-        weights = np.asarray(weights, dtype=np.float64)
+        dtype = data.get('dtype', 'float64')
+        weights = np.asarray(weights, dtype=dtype)
 
         s = cls(data['num_neurons'],
                 data['data_dimensionality'],
-                data['params']['lr']['orig'],
-                neighborhood=data['params']['infl']['orig'],
-                valfunc=data['valfunc'],
+                data['params'],
                 argfunc=data['argfunc'],
-                lr_lambda=data['params']['lr']['factor'],
-                nb_lambda=data['params']['nb']['factor'])
+                valfunc=data['valfunc'],
+                dtype=dtype)
 
         s.weights = weights
         s.trained = True
+        s._load_scaler(data)
 
         return s
 
     def save(self, path):
-        """Save a SOM to a JSON file."""
-        to_save = {}
+        """
+        Save the model.
+
+        Parameters
+        ----------
+        path : str
+            The path to save to. If this ends with .npz, the model is saved
+            in a binary format, in which the weights can be memory-mapped
+            when loading. Otherwise, the model is saved as JSON, which is
+            only recommended for small models.
+
+        """
+        arrays = {}
+        attributes = {}
         for x in self.param_names:
             attr = self.__getattribute__(x)
-            if type(attr) == np.ndarray:
-                attr = [[float(x) for x in row] for row in attr]
+            if isinstance(attr, np.ndarray):
+                arrays[x] = attr
+                continue
             elif isinstance(attr, types.FunctionType):
                 attr = attr.__name__
-            to_save[x] = attr
+            elif isinstance(attr, np.dtype):
+                attr = attr.name
+            attributes[x] = attr
+
+        if self.scaler is not None and self.scaler.is_fit:
+            arrays['scaler_mean'] = self.scaler.mean
+            arrays['scaler_std'] = self.scaler.std
+
+        write_model(path, arrays, attributes)
+
+    def _load_scaler(self, data):
+        """Restore the scaler statistics saved with a model, if any."""
+        if 'scaler_mean' not in data:
+            return
 
-        json.dump(to_save, open(path, 'w'))
+        self.scaler = Scaler()
+        self.scaler.mean = np.asarray(data['scaler_mean'], dtype=self.dtype)
+        self.scaler.std = np.asarray(data['scaler_std'], dtype=self.dtype)
+        self.scaler.is_fit = True
@@ -0,0 +1,133 @@
+"""
+Training data which does not have to fit in memory.
+
+Data can be passed to fit as a numpy array, a np.memmap, the path to a .npy
+file, or a list of 2D chunks, which can themselves be memory-mapped. Data
+which is not in memory is only read one batch at a time, and is scaled
+per batch instead of all at once.
+"""
+import numpy as np
+
+
+def load_data(X):
+    """
+    Get an array-like object from any of the supported input types.
+
+    Parameters
+    ----------
+    X : numpy array, np.memmap, str or list of numpy arrays
+        The data. A string is opened as a memory-mapped .npy file, a list
+        or tuple of 2D arrays is treated as a list of chunks.
+
+    Returns
+    -------
+    data : numpy array, np.memmap or ChunkedArray
+        The data.
+
+    """
+    if isinstance(X, str):
+        return np.load(X, mmap_mode='r')
+    if isinstance(X, (list, tuple)) and X and all(np.ndim(x) == 2 for x in X):
+        return ChunkedArray(X)
+    return X
+
+
+def in_memory(X):
+    """Check whether the data is an array which is completely in memory."""
+    return isinstance(X, np.ndarray) and not isinstance(X, np.memmap)
+
+
+def iter_chunks(X, chunk_size=10000):
+    """Iterate over consecutive chunks of rows of X."""
+    for idx in range(0, len(X), chunk_size):
+        yield X[idx:idx+chunk_size]
+
+
+class ChunkedArray(object):
+    """
+    A list of 2D arrays which is indexed as a single array along the rows.
+
+    Only slices and integer arrays are supported as indices. Each indexing
+    operation only reads the rows which are asked for.
+
+    Parameters
+    ----------
+    chunks : list of numpy arrays
+        The chunks. All chunks need to have the same number of columns.
+
+    """
+
+    def __init__(self, chunks):
+        """Store the chunks and their offsets."""
+        self.chunks = list(chunks)
+        if len({x.shape[1] for x in self.chunks}) > 1:
+            raise ValueError("All chunks should have the same number of "
+                             "columns.")
+        lengths = [len(x) for x in self.chunks]
+        self.offsets = np.concatenate([[0], np.cumsum(lengths)])
+        self.shape = (int(self.offsets[-1]), self.chunks[0].shape[1])
+        self.dtype = np.result_type(*self.chunks)
+        self.ndim = 2
+
+    def __len__(self):
+        """Get the number of rows."""
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        """Get the rows at index."""
+        if isinstance(index, slice):
+            index = np.arange(*index.indices(len(self)))
+        index = np.asarray(index)
+
+        out = np.empty((len(index), self.shape[1]), dtype=self.dtype)
+        chunk = np.searchsorted(self.offsets, index, side='right') - 1
+        for c in np.unique(chunk):
+            mask = chunk == c
+            out[mask] = self.chunks[c][index[mask] - self.offsets[c]]
+
+        return out
+
+    def __array__(self, dtype=None):
+        """Read all chunks into a single array."""
+        return np.concatenate(self.chunks).astype(dtype or self.dtype,
+                                                  copy=False)
+
+
+class ScaledData(object):
+    """
+    Data which is converted to float and scaled one batch at a time.
+
+    Parameters
+    ----------
+    data : np.memmap or ChunkedArray
+        The unscaled data.
+    scaler : Scaler
+        A fitted scaler. If this is None, the data is only converted.
+    dtype : numpy dtype, optional, default np.float64
+        The dtype to convert the data to.
+
+    """
+
+    def __init__(self, data, scaler=None, dtype=np.float64):
+        """Wrap the data."""
+        self.data = data
+        self.scaler = scaler
+        self.dtype = np.dtype(dtype)
+        self.shape = data.shape
+        self.ndim = data.ndim
+
+    def __len__(self):
+        """Get the number of rows."""
+        return len(self.data)
+
+    def __getitem__(self, index):
+        """Read and scale the rows at index."""
+        # Always copy, because a slice of a memmap is a read-only view.
+        x = np.array(self.data[index], dtype=self.dtype)
+        if self.scaler is None:
+            return x
+        return self.scaler.transform(x, out=x)
+
+    def __array__(self, dtype=None):
+        """Read and scale all data."""
+        return self[:].astype(dtype or self.dtype, copy=False)
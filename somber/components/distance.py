@@ -0,0 +1,65 @@
+"""
+Distance functions.
+
+These are pure numpy versions of the distance functions, and are used
+whenever the compiled somber.dist extension is not available.
+"""
+import numpy as np
+
+
+def euclidean(x, weights):
+    """
+    Calculate the euclidean distance and difference between x and weights.
+
+    Parameters
+    ----------
+    x : numpy array
+        A (batch_size, dim) matrix of input data.
+    weights : numpy array
+        A (num_neurons, dim) matrix of weights.
+
+    Returns
+    -------
+    matrices : tuple of matrices
+        The first matrix is a (batch_size, num_neurons) matrix of distances,
+        the second matrix is a (batch_size, num_neurons, dim) tensor
+        containing the difference between each input and each neuron.
+
+    """
+    diff = x[:, None, :] - weights[None, :, :]
+    return np.linalg.norm(diff, axis=2), diff
+
+
+def euclidean_distance(x, weights):
+    """
+    Calculate only the euclidean distance between x and weights.
+
+    The distance is calculated using the expansion
+    ||x||^2 - 2 * x.W^T + ||w||^2, which takes a single matrix
+    multiplication, and never creates the (batch_size, num_neurons, dim)
+    difference tensor.
+
+    Parameters
+    ----------
+    x : numpy array
+        A (batch_size, dim) matrix of input data.
+    weights : numpy array
+        A (num_neurons, dim) matrix of weights.
+
+    Returns
+    -------
+    distances : numpy array
+        A (batch_size, num_neurons) matrix of distances.
+
+    """
+    x_norm = np.einsum('ij,ij->i', x, x)
+    w_norm = np.einsum('ij,ij->i', weights, weights)
+
+    distance = x.dot(weights.T)
+    distance *= -2
+    distance += x_norm[:, None]
+    distance += w_norm[None, :]
+    # Rounding errors can make the squared distance slightly negative.
+    np.maximum(distance, 0, out=distance)
+
+    return np.sqrt(distance, out=distance)
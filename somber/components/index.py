@@ -0,0 +1,380 @@
+"""Indices for finding BMUs without comparing to all neurons."""
+import numpy as np
+
+from .distance import euclidean_distance
+from .utilities import grid_offsets
+
+
+class BmuIndex(object):
+    """
+    An inverted file index for finding the nearest point to some input.
+
+    The points are clustered into cells using k-means. A query only
+    computes the distance to the centroids, and to the points in the
+    num_probe closest cells, instead of to all points. The points of each
+    cell are stored contiguously, so that the inputs which probe a cell are
+    compared to its points with a single matrix multiplication.
+
+    If exact is True, every result is verified using the triangle
+    inequality: the distance from an input to any point in a cell is at
+    least the distance to the centroid of that cell minus the radius of
+    that cell. The input is also compared to the points of every unsearched
+    cell which could contain a closer point. The results are then identical
+    to an exhaustive search.
+
+    Parameters
+    ----------
+    points : numpy array
+        A (num_points, dim) matrix, e.g. the weights of a SOM.
+    num_cells : int, optional, default None
+        The number of cells. If this is None, sqrt(num_points) cells are used.
+    num_probe : int, optional, default 4
+        The number of cells to search for each input.
+    exact : bool, optional, default True
+        Whether to verify the results, see above.
+    num_iterations : int, optional, default 10
+        The number of k-means iterations used to create the cells.
+    random_state : int or np.random.RandomState, optional, default None
+        The seed for choosing the initial centroids. The global random state
+        is never used, so building an index does not change the results of
+        later training.
+
+    Attributes
+    ----------
+    centroids : numpy array
+        The centroid of each cell. Cells which are empty after k-means
+        are removed.
+    radii : numpy array
+        The largest distance between a centroid and a point in its cell.
+    order : numpy array
+        The index of each point, ordered by cell.
+    offsets : numpy array
+        The position in order at which each cell starts, followed by the
+        number of points.
+
+    """
+
+    def __init__(self,
+                 points,
+                 num_cells=None,
+                 num_probe=4,
+                 exact=True,
+                 num_iterations=10,
+                 random_state=None):
+        """Build the index."""
+        self.points = points
+        if num_cells is None:
+            num_cells = int(np.ceil(np.sqrt(len(points))))
+        num_cells = min(num_cells, len(points))
+        self.exact = exact
+
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+        centroids = points[random_state.choice(len(points),
+                                               num_cells,
+                                               replace=False)]
+        for _ in range(num_iterations):
+            assignment = euclidean_distance(points, centroids).argmin(1)
+            counts = np.bincount(assignment, minlength=num_cells)
+            summed = np.zeros_like(centroids)
+            np.add.at(summed, assignment, points)
+            # Empty cells keep their centroid.
+            mask = counts > 0
+            centroids[mask] = summed[mask] / counts[mask, None]
+
+        distance = euclidean_distance(points, centroids)
+        assignment = distance.argmin(1)
+        distance = distance[np.arange(len(points)), assignment]
+
+        # Remove the cells which are still empty, e.g. because of duplicate
+        # points, so that every probed cell contains points.
+        nonempty = np.bincount(assignment, minlength=num_cells) > 0
+        centroids = centroids[nonempty]
+        assignment = (np.cumsum(nonempty) - 1)[assignment]
+        num_cells = len(centroids)
+        self.num_probe = min(num_probe, num_cells)
+
+        self.centroids = centroids
+        self.radii = np.zeros(num_cells)
+        np.maximum.at(self.radii, assignment, distance)
+
+        counts = np.bincount(assignment, minlength=num_cells)
+        self.order = np.argsort(assignment, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        # The points of each cell form a contiguous block.
+        self._blocks = np.ascontiguousarray(points[self.order])
+        self._norms = np.einsum('ij,ij->i', self._blocks, self._blocks)
+
+    def query(self, X, batch_size=1024):
+        """
+        Find the closest point for each input.
+
+        Parameters
+        ----------
+        X : numpy array
+            A (num_items, dim) matrix of input data.
+        batch_size : int, optional, default 1024
+            The number of items to process at the same time.
+
+        Returns
+        -------
+        index : numpy array
+            The index of the closest point for each item.
+        distance : numpy array
+            The euclidean distance to the closest point for each item.
+
+        """
+        index = np.zeros(len(X), dtype=np.intp)
+        distance = np.zeros(len(X), dtype=self.points.dtype)
+
+        for idx in range(0, len(X), batch_size):
+            x = X[idx:idx+batch_size]
+            i, d = self._query(x)
+            index[idx:idx+batch_size] = i
+            distance[idx:idx+batch_size] = d
+
+        return index, distance
+
+    def _query(self, x):
+        """Find the closest point for a single batch."""
+        rows = np.arange(len(x))
+        to_centroids = euclidean_distance(x, self.centroids)
+        probe = np.argpartition(to_centroids,
+                                self.num_probe - 1,
+                                axis=1)[:, :self.num_probe]
+
+        x_norms = np.einsum('ij,ij->i', x, x)
+        best = np.full(len(x), np.inf)
+        position = np.zeros(len(x), dtype=np.intp)
+        self._scan(x, x_norms, rows.repeat(self.num_probe), probe.ravel(),
+                   best, position)
+
+        if self.exact:
+            # Also scan all cells which could contain a closer point.
+            lower = to_centroids - self.radii[None, :]
+            lower[rows[:, None], probe] = np.inf
+            np.maximum(lower, 0, out=lower)
+            items, cells = np.nonzero(lower ** 2 < best[:, None])
+            self._scan(x, x_norms, items, cells, best, position)
+
+        return self.order[position], np.sqrt(np.maximum(best, 0))
+
+    def _scan(self, x, x_norms, items, cells, best, position):
+        """
+        Compare inputs to the points in some cells.
+
+        The inputs are grouped by cell, and all inputs in a group are
+        compared to the points of the cell with a single matrix
+        multiplication.
+
+        Parameters
+        ----------
+        x : numpy array
+            The inputs.
+        x_norms : numpy array
+            The squared norm of each input.
+        items : numpy array
+            The index of an input for each pair of an input and a cell.
+        cells : numpy array
+            The cell for each pair.
+        best : numpy array
+            The squared distance to the closest point found so far for each
+            input. This is updated.
+        position : numpy array
+            The position of the closest point in order for each input. This
+            is updated.
+
+        """
+        by_cell = np.argsort(cells, kind='stable')
+        items = items[by_cell]
+        bounds = np.searchsorted(cells[by_cell],
+                                 np.arange(len(self.centroids) + 1))
+
+        for cell in np.flatnonzero(np.diff(bounds)):
+            start, end = self.offsets[cell], self.offsets[cell + 1]
+            if start == end:
+                continue
+            item = items[bounds[cell]:bounds[cell + 1]]
+
+            # Squared distance via the expansion ||x||^2 - 2xw + ||w||^2
+            distance = x[item].dot(self._blocks[start:end].T)
+            distance *= -2
+            distance += self._norms[None, start:end]
+            closest = distance.argmin(1)
+            distance = distance[np.arange(len(item)), closest]
+            distance += x_norms[item]
+
+            better = distance < best[item]
+            best[item[better]] = distance[better]
+            position[item[better]] = start + closest[better]
+
+
+class BmuCache(object):
+    """
+    Remembers the BMU of each training item, and searches around it.
+
+    In later epochs, the BMU of an item is almost always on or next to its
+    BMU in the previous epoch. Instead of comparing an item to all neurons,
+    it is only compared to the neurons within radius of the neuron which was
+    its BMU when it was last compared to all neurons, its center.
+
+    The result is verified with a lower bound on the distance from each
+    item to the neurons outside the neighborhood of its center, which is
+    stored when the item is compared to all neurons. Between two calls to
+    start_epoch, the largest distance any neuron has moved from the weights
+    at the start is tracked, and the bound is lowered by this distance, so
+    it stays valid as the weights change. If the local result is further
+    away than the bound, the item needs a full search.
+
+    Parameters
+    ----------
+    num_items : int
+        The number of training items.
+    map_dimensions : tuple
+        The map size.
+    radius : float, optional, default 3
+        The grid radius around the center to search.
+
+    """
+
+    def __init__(self, num_items, map_dimensions, radius=3):
+        """Create an empty cache."""
+        self.center = np.full(num_items, -1, dtype=np.intp)
+        self.lower = np.full(num_items, -np.inf)
+        self.max_lower = -np.inf
+
+        # The neighbors of each neuron, padded with the neuron itself, which
+        # is always in its neighborhood.
+        map_dimensions = tuple(map_dimensions)
+        num_neurons = int(np.prod(map_dimensions))
+        offsets, _ = grid_offsets(map_dimensions, radius ** 2)
+        coords = np.stack(np.unravel_index(np.arange(num_neurons),
+                                           map_dimensions), 1)
+        neighbors = coords[:, None, :] + offsets[None, :, :]
+        valid = np.all((neighbors >= 0)
+                       & (neighbors < np.asarray(map_dimensions)), 2)
+        neighbors = np.ravel_multi_index(tuple(np.moveaxis(neighbors, 2, 0)),
+                                         map_dimensions,
+                                         mode='clip')
+        self.neighbors = np.where(valid,
+                                  neighbors,
+                                  np.arange(num_neurons)[:, None])
+
+        self.weights = None
+        self.max_moved = 0.
+
+    def start_epoch(self, weights):
+        """
+        Store the weights, from which the movement of the neurons is tracked.
+
+        If a neuron had moved at most m1 from the previous weights when the
+        bound of an item was stored, and has moved at most m2 now, it has
+        moved at most m1 + m2 since the bound was stored. m1 is accounted
+        for when the bound is stored, so the bounds are lowered by m2.
+        m2 is measured over all neurons here, so that updates which were
+        not recorded with moved, such as those of the batch SOM, are also
+        accounted for.
+
+        Parameters
+        ----------
+        weights : numpy array
+            The current weights.
+
+        """
+        if self.weights is not None:
+            self.moved(slice(None), weights)
+        self.lower -= self.max_moved
+        self.max_lower = self.lower.max()
+        self.weights = weights.copy()
+        self.max_moved = 0.
+
+    def moved(self, neurons, weights):
+        """
+        Record an update to the weights, to keep the bounds valid.
+
+        Only the updated neurons have moved, so only their distance to the
+        stored weights is calculated.
+
+        Parameters
+        ----------
+        neurons : slice or numpy array
+            The neurons which were updated.
+        weights : numpy array
+            The weights after the update.
+
+        """
+        difference = weights[neurons] - self.weights[neurons]
+        if len(difference):
+            moved = np.einsum('ij,ij->i', difference, difference).max()
+            self.max_moved = max(self.max_moved, np.sqrt(moved))
+
+    def query(self, x, indices, weights):
+        """
+        Find the BMU of each item using a local search.
+
+        Parameters
+        ----------
+        x : numpy array
+            A batch of input data.
+        indices : numpy array
+            The index of each item in the training data.
+        weights : numpy array
+            The current weights.
+
+        Returns
+        -------
+        bmu : numpy array
+            The BMU of each item, or -1 if an item needs a full search.
+
+        """
+        center = self.center[indices]
+        bmu = np.full(len(center), -1, dtype=np.intp)
+        # If the neurons have moved further than any bound, e.g. early in
+        # training, no result can be verified.
+        if self.max_moved > self.max_lower:
+            return bmu
+        known = np.flatnonzero(center >= 0)
+        if not len(known):
+            return bmu
+
+        x = x[known]
+        rows = np.arange(len(known))
+        candidates = self.neighbors[center[known]]
+
+        # Squared distance via the expansion ||x||^2 - 2xw + ||w||^2
+        candidate_weights = weights[candidates]
+        distance = -2 * np.einsum('ij,ikj->ik', x, candidate_weights)
+        distance += np.einsum('ikj,ikj->ik',
+                              candidate_weights,
+                              candidate_weights)
+        distance += np.einsum('ij,ij->i', x, x)[:, None]
+
+        best = distance.argmin(1)
+        distance = np.sqrt(np.maximum(distance[rows, best], 0))
+
+        bound = self.lower[indices][known] - self.max_moved
+        verified = distance <= bound
+
+        bmu[known] = np.where(verified, candidates[rows, best], -1)
+        return bmu
+
+    def store(self, indices, distance, bmu):
+        """
+        Store the center and bound of items compared to all neurons.
+
+        Parameters
+        ----------
+        indices : numpy array
+            The index of each item in the training data.
+        distance : numpy array
+            The distance from each item to each neuron. This is changed.
+        bmu : numpy array
+            The BMU of each item.
+
+        """
+        rows = np.arange(len(distance))[:, None]
+        distance[rows, self.neighbors[bmu]] = np.inf
+        self.center[indices] = bmu
+        self.lower[indices] = distance.min(1) - self.max_moved
+        self.max_lower = max(self.max_lower, self.lower[indices].max())
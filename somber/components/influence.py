@@ -0,0 +1,636 @@
+"""
+Representations of the influence between neurons.
+
+The influence of a neuron on other neurons is normally given as a dense
+(num_neurons, num_neurons) matrix. For large maps, this matrix no longer fits
+in memory, so the classes in this file offer the subset of the numpy array
+interface which is used during training: gathering the influence rows of
+BMUs, transposing, scaling by a learning rate, and multiplying with a matrix.
+"""
+import numpy as np
+
+from collections import OrderedDict
+
+from .utilities import grid_offsets
+
+
+class BaseInfluence(object):
+    """Base class for influence representations."""
+
+    def statistics(self, index, x):
+        """
+        Calculate the per-neuron statistics needed for an update.
+
+        Parameters
+        ----------
+        index : numpy array
+            The BMUs of a batch of input data, or, for the neural gas, the
+            rank of each neuron for each item.
+        x : numpy array
+            The batch of input data.
+
+        Returns
+        -------
+        neurons : slice or numpy array
+            The neurons which receive any influence.
+        weighted_x : numpy array
+            The influence-weighted sum of the input data for each neuron
+            in neurons.
+        total : numpy array
+            The summed influence for each neuron in neurons.
+
+        """
+        rows = self[index]
+        return slice(None), rows.T.dot(x), rows.sum(0)
+
+
+class RankInfluence(BaseInfluence):
+    """
+    Influence of the neural gas, which depends on the rank of each neuron.
+
+    The influence of the neuron with rank r is exp(-r / lambda), which is
+    negligible beyond a few lambda. Only the influence of the first
+    num_ranks ranks is stored, and only the neurons with these ranks are
+    updated. Instead of ranks, the influence is indexed with the neurons
+    with the lowest ranks for each item, in order of rank.
+
+    Parameters
+    ----------
+    influence : numpy array
+        The influence of the first num_ranks ranks.
+    num_neurons : int
+        The number of neurons.
+    scale : float, optional, default 1.0
+        A constant with which the influence is multiplied, e.g. the
+        learning rate.
+
+    Attributes
+    ----------
+    num_ranks : int
+        The number of ranks with an influence.
+
+    """
+
+    def __init__(self, influence, num_neurons, scale=1.0):
+        """Store the influence."""
+        self.influence = influence
+        self.num_neurons = num_neurons
+        self.num_ranks = len(influence)
+        # A python float does not change the dtype of the results.
+        self.scale = float(scale)
+
+    def __mul__(self, other):
+        """Scale the influence by a constant."""
+        return type(self)(self.influence, self.num_neurons, self.scale * other)
+
+    __rmul__ = __mul__
+
+    def statistics(self, order, x):
+        """
+        Calculate the per-neuron statistics needed for an update.
+
+        Only the neurons which have one of the first num_ranks ranks for any
+        of the items are returned.
+
+        Parameters
+        ----------
+        order : numpy array
+            A (batch_size, num_ranks) array containing, for each item, the
+            neurons with the lowest ranks, in order of rank.
+        x : numpy array
+            The batch of input data.
+
+        Returns
+        -------
+        neurons : slice or numpy array
+            The neurons which receive any influence.
+        weighted_x : numpy array
+            The influence-weighted sum of the input data for each neuron
+            in neurons.
+        total : numpy array
+            The summed influence for each neuron in neurons.
+
+        """
+        if self.num_ranks == self.num_neurons:
+            # Every neuron has a rank, so all neurons are updated.
+            neurons, inverse = slice(None), order
+        else:
+            neurons, inverse = np.unique(order, return_inverse=True)
+            inverse = inverse.reshape(order.shape)
+
+        # A neuron has a single rank per item, so no entries are summed.
+        rows = np.zeros((len(order), inverse.max() + 1),
+                        dtype=self.influence.dtype)
+        np.put_along_axis(rows, inverse, self.influence * self.scale, 1)
+
+        return neurons, rows.T.dot(x), rows.sum(0)
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the influence."""
+        return self.influence.nbytes
+
+
+class SeparableInfluence(BaseInfluence):
+    """
+    Gaussian influence on a rectangular grid, stored as per-axis kernels.
+
+    On a rectangular grid, the squared distance between two neurons is the
+    sum of the squared distances along each axis. The gaussian influence
+    therefore factorizes into one small kernel per axis, and the full
+    influence matrix is the Kronecker product of these kernels. Because only
+    the kernels are stored, memory goes from O(num_neurons ** 2) to
+    O(sum(map_dimensions ** 2)).
+
+    Parameters
+    ----------
+    kernels : list of numpy arrays
+        A list containing a (width, width) kernel for each map dimension.
+    scale : float, optional, default 1.0
+        A constant with which the influence is multiplied, e.g. the
+        learning rate.
+
+    Attributes
+    ----------
+    dtype : numpy dtype
+        The dtype of the kernels, and of all results.
+    map_dimensions : tuple
+        The map size, as derived from the kernels.
+    shape : tuple
+        The shape of the dense influence matrix.
+
+    """
+
+    def __init__(self, kernels, scale=1.0):
+        """Store the kernels."""
+        self.kernels = kernels
+        # A python float does not change the dtype of the results.
+        self.scale = float(scale)
+        self.dtype = kernels[0].dtype
+        self.map_dimensions = tuple(len(k) for k in kernels)
+        num_neurons = int(np.prod(self.map_dimensions))
+        self.shape = (num_neurons, num_neurons)
+
+    @classmethod
+    def gaussian(cls, map_dimensions, neighborhood, dtype=np.float64):
+        """
+        Create the influence exp(-distance ** 2 / neighborhood ** 2).
+
+        Parameters
+        ----------
+        map_dimensions : tuple
+            The map size.
+        neighborhood : float
+            The neighborhood value.
+        dtype : numpy dtype, optional, default np.float64
+            The dtype of the influence.
+
+        Returns
+        -------
+        influence : SeparableInfluence
+            The influence from each neuron to each other neuron.
+
+        """
+        kernels = []
+        for width in map_dimensions:
+            r = np.arange(width)
+            squared = (r[:, None] - r[None, :]) ** 2
+            kernel = np.exp(-squared / (neighborhood ** 2))
+            kernels.append(kernel.astype(dtype))
+
+        return cls(kernels)
+
+    @property
+    def T(self):
+        """The transpose of the influence, which is symmetric."""
+        return self
+
+    def __mul__(self, other):
+        """Scale the influence by a constant."""
+        return type(self)(self.kernels, self.scale * other)
+
+    __rmul__ = __mul__
+
+    def __getitem__(self, index):
+        """
+        Gather the influence rows of the neurons in index.
+
+        The rows are built as the outer product of the kernel rows of each
+        axis, which gives the same ordering as np.ravel_multi_index.
+
+        Parameters
+        ----------
+        index : numpy array
+            An array of neuron indices, e.g. the BMUs of a batch.
+
+        Returns
+        -------
+        rows : numpy array
+            An array of shape index.shape + (num_neurons,).
+
+        """
+        index = np.asarray(index)
+        flat = index.ravel()
+        coords = np.unravel_index(flat, self.map_dimensions)
+
+        rows = np.full((len(flat), 1), self.scale, dtype=self.dtype)
+        for kernel, coord in zip(self.kernels, coords):
+            rows = rows[:, :, None] * kernel[coord][:, None, :]
+            rows = rows.reshape(len(flat), -1)
+
+        return rows.reshape(index.shape + (self.shape[1],))
+
+    def dot(self, X):
+        """
+        Multiply the influence matrix with X.
+
+        The kernel of each axis is applied separately, which is a separable
+        convolution of X over the map.
+
+        Parameters
+        ----------
+        X : numpy array
+            An array of which the first dimension is num_neurons.
+
+        Returns
+        -------
+        product : numpy array
+            An array with the same shape as X.
+
+        """
+        X = np.asarray(X)
+        out = X.reshape(self.map_dimensions + (-1,))
+        for axis, kernel in enumerate(self.kernels):
+            out = np.tensordot(kernel, out, axes=([1], [axis]))
+            out = np.moveaxis(out, 0, axis)
+
+        return self.scale * out.reshape(X.shape)
+
+    def todense(self):
+        """Get the full influence matrix."""
+        return self[np.arange(self.shape[0])]
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the influence."""
+        return sum(k.nbytes for k in self.kernels)
+
+
+class SparseInfluence(BaseInfluence):
+    """
+    Truncated influence, of which only the nonzero entries are used.
+
+    Once the neighborhood has become small, almost all entries of the
+    influence matrix are negligible. Only the entries above some threshold
+    are kept, so that an update only touches the neurons in the
+    neighborhood of the BMUs.
+
+    Because the influence only depends on the offset between two neurons
+    on the grid, only the offsets within the truncation radius and their
+    influence are stored. The entries of a row are generated when the row
+    is gathered, so gathering the rows of a batch of BMUs costs
+    O(batch_size * num_offsets), independent of the size of the map, and
+    creating the influence for a new neighborhood is almost free.
+
+    Parameters
+    ----------
+    map_dimensions : tuple
+        The map size.
+    offsets : numpy array
+        A (num_offsets, len(map_dimensions)) array of grid offsets.
+    values : numpy array
+        The influence at each offset.
+    scale : float, optional, default 1.0
+        A constant with which the influence is multiplied, e.g. the
+        learning rate.
+
+    Attributes
+    ----------
+    dtype : numpy dtype
+        The dtype of the values, and of all results.
+    shape : tuple
+        The shape of the dense influence matrix.
+
+    """
+
+    def __init__(self, map_dimensions, offsets, values, scale=1.0):
+        """Store the offsets and their influence."""
+        self.map_dimensions = tuple(map_dimensions)
+        self.offsets = offsets
+        self.values = values
+        # A python float does not change the dtype of the results.
+        self.scale = float(scale)
+        self.dtype = values.dtype
+        num_neurons = int(np.prod(self.map_dimensions))
+        self.shape = (num_neurons, num_neurons)
+
+    @classmethod
+    def gaussian(cls,
+                 map_dimensions,
+                 neighborhood,
+                 epsilon,
+                 dtype=np.float64):
+        """
+        Create the influence exp(-distance ** 2 / neighborhood ** 2).
+
+        All entries smaller than epsilon are left out.
+
+        Parameters
+        ----------
+        map_dimensions : tuple
+            The map size.
+        neighborhood : float
+            The neighborhood value.
+        epsilon : float
+            The smallest influence to keep.
+        dtype : numpy dtype, optional, default np.float64
+            The dtype of the influence.
+
+        Returns
+        -------
+        influence : SparseInfluence
+            The influence from each neuron to each other neuron.
+
+        """
+        offsets, squared = _offsets(map_dimensions, neighborhood, epsilon)
+        values = np.exp(-squared / (neighborhood ** 2)).astype(dtype)
+
+        return cls(map_dimensions, offsets, values)
+
+    @property
+    def T(self):
+        """The transpose of the influence, which is symmetric."""
+        return self
+
+    def __mul__(self, other):
+        """Scale the influence by a constant."""
+        return type(self)(self.map_dimensions,
+                          self.offsets,
+                          self.values,
+                          self.scale * other)
+
+    __rmul__ = __mul__
+
+    def _gather(self, index):
+        """
+        Get the row number, column and value of each entry in index.
+
+        The entries are sorted by row, and every row contains at least the
+        neuron itself.
+        """
+        coords = np.stack(np.unravel_index(index, self.map_dimensions), 1)
+        neighbors = coords[:, None, :] + self.offsets[None, :, :]
+        inside = neighbors < np.asarray(self.map_dimensions)
+        valid = np.all((neighbors >= 0) & inside, 2)
+        rows, positions = np.nonzero(valid)
+
+        cols = np.ravel_multi_index(tuple(neighbors[rows, positions].T),
+                                    self.map_dimensions)
+        return rows, cols, self.values[positions] * self.scale
+
+    def __getitem__(self, index):
+        """Gather the influence rows of the neurons in index as an array."""
+        index = np.asarray(index)
+        flat = index.ravel()
+        rows, cols, values = self._gather(flat)
+
+        out = np.zeros((len(flat), self.shape[1]), dtype=self.dtype)
+        out[rows, cols] = values
+        return out.reshape(index.shape + (self.shape[1],))
+
+    def statistics(self, index, x):
+        """
+        Calculate the per-neuron statistics needed for an update.
+
+        Only the neurons in the neighborhood of any of the BMUs are returned.
+
+        Parameters
+        ----------
+        index : numpy array
+            The BMUs of a batch of input data.
+        x : numpy array
+            The batch of input data.
+
+        Returns
+        -------
+        neurons : numpy array
+            The neurons which receive any influence.
+        weighted_x : numpy array
+            The influence-weighted sum of the input data for each neuron
+            in neurons.
+        total : numpy array
+            The summed influence for each neuron in neurons.
+
+        """
+        rows, cols, values = self._gather(np.asarray(index))
+        neurons, inverse = np.unique(cols, return_inverse=True)
+
+        total = np.bincount(inverse, weights=values, minlength=len(neurons))
+        total = total.astype(values.dtype, copy=False)
+        weighted_x = np.zeros((len(neurons), x.shape[1]),
+                              dtype=np.result_type(values, x))
+        np.add.at(weighted_x, inverse, values[:, None] * x[rows])
+
+        return neurons, weighted_x, total
+
+    def dot(self, X):
+        """
+        Multiply the influence matrix with X.
+
+        Because the influence only depends on the offset between two
+        neurons, the product is the sum of X shifted over the map by each
+        offset, weighted by its influence. The rows are therefore never
+        gathered, and the memory needed is that of the result.
+
+        Parameters
+        ----------
+        X : numpy array
+            An array of which the first dimension is num_neurons.
+
+        Returns
+        -------
+        product : numpy array
+            An array with the same shape as X.
+
+        """
+        X = np.asarray(X)
+        grid = X.reshape(self.map_dimensions + (-1,))
+        out = np.zeros(grid.shape, dtype=np.result_type(self.values, X))
+
+        for offset, value in zip(self.offsets.tolist(), self.values.tolist()):
+            # Row i receives column i + offset, if it is on the map.
+            target = tuple(slice(max(0, -o), w - max(0, o))
+                           for o, w in zip(offset, self.map_dimensions))
+            source = tuple(slice(max(0, o), w - max(0, -o))
+                           for o, w in zip(offset, self.map_dimensions))
+            out[target] += value * grid[source]
+
+        out *= self.scale
+        return out.reshape(X.shape)
+
+    def todense(self):
+        """Get the full influence matrix."""
+        return self[np.arange(self.shape[0])]
+
+    @property
+    def nbytes(self):
+        """The number of bytes used by the influence."""
+        return self.offsets.nbytes + self.values.nbytes
+
+
+def _offsets(map_dimensions, neighborhood, epsilon):
+    """
+    Get all grid offsets with an influence of at least epsilon.
+
+    Returns
+    -------
+    offsets : numpy array
+        A (num_offsets, len(map_dimensions)) array of offsets.
+    squared : numpy array
+        The squared grid distance of each offset.
+
+    """
+    # exp(-d ** 2 / n ** 2) >= epsilon if d ** 2 <= -log(epsilon) * n ** 2
+    return grid_offsets(map_dimensions, -np.log(epsilon) * neighborhood ** 2)
+
+
+def gaussian_influence(map_dimensions,
+                       neighborhood,
+                       epsilon=None,
+                       max_density=.1,
+                       dtype=np.float64):
+    """
+    Create the gaussian influence for a map.
+
+    If epsilon is set, a SparseInfluence is returned as soon as the
+    truncated neighborhood of a neuron covers less than max_density of
+    the map. Otherwise, a SeparableInfluence is returned.
+
+    Parameters
+    ----------
+    map_dimensions : tuple
+        The map size.
+    neighborhood : float
+        The neighborhood value.
+    epsilon : float, optional, default None
+        The smallest influence to keep. If this is None, the influence
+        is never truncated.
+    max_density : float, optional, default .1
+        The largest proportion of the map a truncated neighborhood can
+        cover for the sparse representation to be used.
+    dtype : numpy dtype, optional, default np.float64
+        The dtype of the influence.
+
+    Returns
+    -------
+    influence : SeparableInfluence or SparseInfluence
+        The influence from each neuron to each other neuron.
+
+    """
+    if epsilon is not None:
+        offsets, _ = _offsets(map_dimensions, neighborhood, epsilon)
+        if len(offsets) < max_density * np.prod(map_dimensions):
+            return SparseInfluence.gaussian(map_dimensions,
+                                            neighborhood,
+                                            epsilon,
+                                            dtype)
+
+    return SeparableInfluence.gaussian(map_dimensions, neighborhood, dtype)
+
+
+class InfluenceCache(object):
+    """
+    A least recently used cache of influences.
+
+    Calculating the influence is expensive, while the neighborhood value
+    often barely changes between updates. The influence is therefore cached
+    on the neighborhood value, rounded to a number of significant digits.
+    The influence itself is also calculated with this rounded value, so
+    that results do not depend on the state of the cache.
+
+    Parameters
+    ----------
+    max_bytes : int, optional, default 2 ** 27
+        The maximum number of bytes the cached influences can take up.
+        If this is exceeded, the least recently used influences are evicted.
+    precision : int, optional, default 4
+        The number of significant digits of the neighborhood value to use.
+
+    """
+
+    def __init__(self, max_bytes=2 ** 27, precision=4):
+        """Create an empty cache."""
+        self.max_bytes = max_bytes
+        self.precision = precision
+        self.nbytes = 0
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        """Return the number of cached influences."""
+        return len(self._cache)
+
+    def __contains__(self, neighborhood):
+        """Return whether the influence for a neighborhood value is cached."""
+        return self.quantize(neighborhood) in self._cache
+
+    def quantize(self, neighborhood):
+        """Round a neighborhood value to the precision of the cache."""
+        return float("{0:.{1}g}".format(neighborhood, self.precision))
+
+    def get(self, neighborhood, calculate):
+        """
+        Get the influence for a neighborhood value.
+
+        Parameters
+        ----------
+        neighborhood : float
+            The neighborhood value.
+        calculate : function
+            The function with which to calculate the influence if it is not
+            in the cache. Gets called with the rounded neighborhood value.
+
+        Returns
+        -------
+        influence : influence instance
+            The influence for the rounded neighborhood value.
+
+        """
+        key = self.quantize(neighborhood)
+        try:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        influence = calculate(key)
+        self.put(key, influence)
+
+        return influence
+
+    def put(self, neighborhood, influence):
+        """
+        Add the influence for a neighborhood value to the cache.
+
+        Parameters
+        ----------
+        neighborhood : float
+            The neighborhood value.
+        influence : influence instance
+            The influence for the rounded neighborhood value.
+
+        """
+        key = self.quantize(neighborhood)
+        if key in self._cache:
+            self.nbytes -= self._cache.pop(key).nbytes
+        self._cache[key] = influence
+        self.nbytes += influence.nbytes
+
+        # Never evict the influence that was just added.
+        while self.nbytes > self.max_bytes and len(self._cache) > 1:
+            _, evicted = self._cache.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        """Remove all influences from the cache."""
+        self._cache.clear()
+        self.nbytes = 0
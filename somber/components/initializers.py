@@ -6,13 +6,17 @@ called to initialize the weight to a value at the beginning of training.
 """
 import numpy as np
 
+from .data import iter_chunks
 
-def range_initialization(X, num_weights):
+
+def range_initialization(X, num_weights, chunk_size=10000):
     """
     Initialize the weights by calculating the range of the data.
 
     The data range is calculated by reshaping the input matrix to a
     2D matrix, and then taking the min and max values over the columns.
+    The range is accumulated over chunks of rows, so X can be any
+    array-like which supports slicing, e.g. a memory-mapped array.
 
     Parameters
     ----------
@@ -20,6 +24,8 @@ def range_initialization(X, num_weights):
         The input data. The data range is calculated over the last axis.
     num_weights : int
         The number of weights to initialize.
+    chunk_size : int, optional, default 10000
+        The number of rows to process at the same time.
 
     Returns
     -------
@@ -29,8 +35,14 @@ def range_initialization(X, num_weights):
 
     """
     # Randomly initialize weights to cover the range of each feature.
-    X_ = X.reshape(-1, X.shape[-1])
-    min_val, max_val = X_.min(0), X_.max(0)
+    if X.ndim > 2:
+        X = X.reshape(-1, X.shape[-1])
+
+    min_val = np.full(X.shape[-1], np.inf)
+    max_val = np.full(X.shape[-1], -np.inf)
+    for x in iter_chunks(X, chunk_size):
+        np.minimum(min_val, x.min(0), out=min_val)
+        np.maximum(max_val, x.max(0), out=max_val)
     data_range = max_val - min_val
 
     return data_range * np.random.rand(num_weights,
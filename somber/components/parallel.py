@@ -0,0 +1,195 @@
+"""
+Data-parallel training over multiple processes.
+
+The training data and the weights are put in shared memory, so that
+they are not copied to each worker. For each batch, every worker finds the
+BMUs for a shard of the batch, and writes the per-neuron statistics needed
+for the update to its own slot of a shared buffer. The slots are summed in
+place, and the update is applied to the shared weights by the main
+process. Because the update is the same as for a single process, the
+parameter schedules are not affected.
+"""
+import os
+import numpy as np
+
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+
+# The state of a worker process, set in _init_worker.
+_worker = {}
+
+
+def _share(array):
+    """Copy an array to shared memory."""
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[:] = array
+    return shm, shared
+
+
+def _attach(name, shape, dtype):
+    """Get an array from shared memory."""
+    shm = SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _init_worker(model, data, weights, weighted_x, total):
+    """Attach the worker to the shared data, weights and statistics."""
+    data_shm, X = _attach(*data)
+    weights_shm, model.weights = _attach(*weights)
+    weighted_shm, weighted_x = _attach(*weighted_x)
+    total_shm, total = _attach(*total)
+    _worker.update(model=model,
+                   X=X,
+                   weighted_x=weighted_x,
+                   total=total,
+                   shm=(data_shm, weights_shm, weighted_shm, total_shm))
+
+
+def _statistics(args):
+    """Write the update statistics for a shard of a batch to its slot."""
+    slot, index, params = args
+    model = _worker['model']
+    model.params = params
+
+    x = _worker['X'][index]
+    bmu = model._get_bmu(model.activate(x))
+    neurons, w, t = model._current_influence().statistics(bmu, x)
+
+    weighted_x = _worker['weighted_x'][slot]
+    total = _worker['total'][slot]
+    weighted_x[:] = 0
+    total[:] = 0
+    weighted_x[neurons] = w
+    total[neurons] = t
+
+
+def _batch_statistics(args):
+    """Write the batch SOM statistics for a shard of the data to its slot."""
+    slot, start, stop, batch_size = args
+    counts, summed = _worker['model']._batch_statistics(_worker['X'],
+                                                        start,
+                                                        stop,
+                                                        batch_size)
+    _worker['total'][slot] = counts
+    _worker['weighted_x'][slot] = summed
+
+
+class DataParallel(object):
+    """
+    A pool of worker processes sharing the data and weights of a model.
+
+    While the pool is open, the weights of the model are replaced by a
+    shared copy. Closing the pool copies them back. Each worker writes its
+    statistics to its own slot of a buffer in shared memory, which is
+    allocated once, so that no statistics are sent between processes.
+
+    Parameters
+    ----------
+    model : Base
+        The model to train.
+    X : numpy array
+        The training data.
+    n_jobs : int
+        The number of processes to use. If this is -1, all cores are used.
+
+    """
+
+    def __init__(self, model, X, n_jobs):
+        """Create the shared memory and start the workers."""
+        if n_jobs < 0:
+            n_jobs = os.cpu_count()
+        self.n_jobs = n_jobs
+        self.model = model
+
+        self._data_shm, self.X = _share(X)
+        self._weights_shm, model.weights = _share(model.weights)
+        weights = model.weights
+        self._weighted_shm, self.weighted_x = _share(
+            np.zeros((n_jobs,) + weights.shape, dtype=weights.dtype))
+        self._total_shm, self.total = _share(
+            np.zeros((n_jobs, len(weights)), dtype=weights.dtype))
+
+        shared = [(shm.name, array.shape, array.dtype)
+                  for shm, array in ((self._data_shm, self.X),
+                                     (self._weights_shm, weights),
+                                     (self._weighted_shm, self.weighted_x),
+                                     (self._total_shm, self.total))]
+        self.pool = Pool(n_jobs, _init_worker, [model] + shared)
+
+    def _reduce(self, num_slots):
+        """Sum the statistics of the first num_slots slots into slot 0."""
+        weighted_x, total = self.weighted_x, self.total
+        for slot in range(1, num_slots):
+            weighted_x[0] += weighted_x[slot]
+            total[0] += total[slot]
+
+        return weighted_x[0], total[0]
+
+    def propagate(self, index):
+        """
+        Update the weights of the model with a single batch.
+
+        Parameters
+        ----------
+        index : numpy array
+            The indices of the items in the batch.
+
+        """
+        shards = [shard for shard in np.array_split(index, self.n_jobs)
+                  if len(shard)]
+        self.pool.map(_statistics,
+                      [(slot, shard, self.model.params)
+                       for slot, shard in enumerate(shards)])
+
+        weights = self.model.weights
+        weighted_x, total = self._reduce(len(shards))
+        weighted_x -= total[:, None] * weights
+        weighted_x /= len(index)
+        weights += weighted_x
+
+    def batch_statistics(self, batch_size):
+        """
+        Calculate the batch SOM statistics over all data.
+
+        Parameters
+        ----------
+        batch_size : int
+            The number of items each worker processes at the same time.
+
+        Returns
+        -------
+        counts : numpy array
+            The number of items for which each neuron is the BMU.
+        summed : numpy array
+            The sum of the items for which each neuron is the BMU.
+
+        """
+        bounds = np.linspace(0, len(self.X), self.n_jobs + 1).astype(int)
+        shards = [(start, stop)
+                  for start, stop in zip(bounds[:-1], bounds[1:])
+                  if stop > start]
+        self.pool.map(_batch_statistics,
+                      [(slot, start, stop, batch_size)
+                       for slot, (start, stop) in enumerate(shards)])
+
+        summed, counts = self._reduce(len(shards))
+        return counts.copy(), summed.copy()
+
+    def close(self):
+        """Stop the workers and copy the weights out of shared memory."""
+        self.pool.close()
+        self.pool.join()
+        self.model.weights = np.array(self.model.weights)
+        # Shared memory can only be closed if no arrays refer to it.
+        self.X = None
+        self.weighted_x = None
+        self.total = None
+
+        for shm in (self._data_shm,
+                    self._weights_shm,
+                    self._weighted_shm,
+                    self._total_shm):
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,137 @@
+"""
+Reading and writing models.
+
+Models are saved either as JSON, which is readable but slow for large maps,
+or as an uncompressed .npz archive. In the archive, every array is stored
+as a raw .npy member, and all other attributes are stored as a JSON string.
+Because the members are not compressed, they can be memory-mapped directly
+from the archive, so loading a model does not read its weights until they
+are used.
+"""
+import json
+import os
+import struct
+import zipfile
+import numpy as np
+
+
+# The name of the member containing the attributes which are not arrays.
+_ATTRIBUTES = "__attributes__"
+
+_HEADER_READERS = {(1, 0): np.lib.format.read_array_header_1_0,
+                   (2, 0): np.lib.format.read_array_header_2_0}
+
+
+def to_builtin(obj):
+    """Convert numpy scalars and arrays to types JSON can serialize."""
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError("{0} is not JSON serializable".format(type(obj)))
+
+
+def is_binary(path):
+    """Check whether a path refers to the binary format."""
+    return str(path).endswith('.npz')
+
+
+def write_model(path, arrays, attributes):
+    """
+    Write a model to path.
+
+    Parameters
+    ----------
+    path : str
+        The path to write to. If this ends with .npz, the binary format is
+        used, otherwise the model is written as JSON. An existing file is
+        only replaced once the model has been written completely.
+    arrays : dict
+        A mapping from names to numpy arrays.
+    attributes : dict
+        A mapping from names to other attributes, which need to be JSON
+        serializable.
+
+    """
+    # The model is first written to a temporary file, which then replaces
+    # path, because the arrays to write may be memory-mapped from path.
+    path = str(path)
+    if is_binary(path):
+        temporary = path[:-len('.npz')] + '.tmp.npz'
+        members = dict(arrays)
+        members[_ATTRIBUTES] = np.array(json.dumps(attributes,
+                                                   default=to_builtin))
+        np.savez(temporary, **members)
+    else:
+        temporary = path + '.tmp'
+        to_save = dict(attributes)
+        to_save.update(arrays)
+        with open(temporary, 'w') as f:
+            json.dump(to_save, f, default=to_builtin)
+    os.replace(temporary, path)
+
+
+def read_model(path, mmap=True):
+    """
+    Read a model written by write_model.
+
+    Parameters
+    ----------
+    path : str
+        The path to read from.
+    mmap : bool, optional, default True
+        Whether to memory-map the arrays of a binary model. The arrays are
+        mapped copy-on-write, so they can be changed without changing the
+        file.
+
+    Returns
+    -------
+    data : dict
+        All attributes and arrays. For JSON, the arrays are nested lists.
+
+    """
+    if not zipfile.is_zipfile(path):
+        with open(path) as f:
+            return json.load(f)
+
+    data = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            array = None
+            if (mmap and name != _ATTRIBUTES
+                    and info.compress_type == zipfile.ZIP_STORED):
+                array = _map_member(path, f, info)
+            if array is None:
+                with archive.open(info) as member:
+                    array = np.lib.format.read_array(member)
+            data[name] = array
+
+    attributes = json.loads(str(data.pop(_ATTRIBUTES)))
+    attributes.update(data)
+    return attributes
+
+
+def _map_member(path, f, info):
+    """
+    Memory-map an uncompressed .npy member of an archive.
+
+    Returns None if the member can not be mapped.
+    """
+    # The data of a member starts after its local file header, which has a
+    # fixed size of 30 bytes, followed by the file name and an extra field.
+    f.seek(info.header_offset)
+    name_length, extra_length = struct.unpack('<HH', f.read(30)[26:30])
+    f.seek(info.header_offset + 30 + name_length + extra_length)
+
+    version = np.lib.format.read_magic(f)
+    if version not in _HEADER_READERS:
+        return None
+    shape, fortran_order, dtype = _HEADER_READERS[version](f)
+    if dtype.hasobject or not np.prod(shape):
+        return None
+
+    return np.memmap(path,
+                     dtype=dtype,
+                     mode='c',
+                     offset=f.tell(),
+                     shape=shape,
+                     order='F' if fortran_order else 'C')
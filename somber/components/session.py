@@ -0,0 +1,152 @@
+"""
+Streaming inference for sequential models.
+
+A session keeps the activation of a sequential model between calls, so that
+items can be presented as they arrive, instead of as a complete sequence.
+A session can hold many independent streams, of which all items which
+arrive at the same time are processed in a single forward pass.
+"""
+import numpy as np
+
+
+class Session(object):
+    """
+    The state of one or more streams presented to a sequential model.
+
+    Parameters
+    ----------
+    model : sequential model
+        A trained instance of one of the models in somber.sequential.
+    num_streams : int, optional, default 1
+        The number of streams.
+
+    Attributes
+    ----------
+    activation : numpy array
+        A (num_streams, num_neurons) array containing the activation of the
+        model in the last step of each stream. The activation of a stream
+        which has not started is all zeros.
+
+    """
+
+    def __init__(self, model, num_streams=1):
+        """Start the streams."""
+        self.model = model
+        self.activation = model._init_prev(num_streams)
+        # Whether the next item of each stream starts a new sequence.
+        self._reset = np.ones(num_streams, dtype=bool)
+        self._argfunc = getattr(np, model.argfunc)
+
+    @property
+    def num_streams(self):
+        """The number of streams."""
+        return len(self.activation)
+
+    def add_streams(self, num_streams=1):
+        """
+        Add streams to the session.
+
+        Parameters
+        ----------
+        num_streams : int, optional, default 1
+            The number of streams to add.
+
+        Returns
+        -------
+        streams : numpy array
+            The indices of the new streams.
+
+        """
+        start = self.num_streams
+        self.activation = np.concatenate([self.activation,
+                                          self.model._init_prev(num_streams)])
+        self._reset = np.concatenate([self._reset,
+                                      np.ones(num_streams, dtype=bool)])
+        return np.arange(start, self.num_streams)
+
+    def reset(self, streams=None):
+        """
+        Reset streams, so that their next item starts a new sequence.
+
+        Parameters
+        ----------
+        streams : int or numpy array, optional, default None
+            The streams to reset. If this is None, all streams are reset.
+
+        """
+        if streams is None:
+            streams = slice(None)
+        self.activation[streams] = 0
+        self._reset[streams] = True
+
+    def step(self, x, streams=None):
+        """
+        Present a single item to each of a number of streams.
+
+        All items are processed in a single forward pass.
+
+        Parameters
+        ----------
+        x : numpy array
+            A (len(streams), data_dimensionality) array containing the next
+            item of each stream. If the session has a single stream, this
+            can also be a single item.
+        streams : int or numpy array, optional, default None
+            The streams to which the items belong. Each stream can only
+            occur once. If this is None, there should be an item for each
+            stream.
+
+        Returns
+        -------
+        bmu : numpy array
+            The BMU of each item.
+
+        """
+        x = np.asarray(x, dtype=self.model.dtype)
+        if x.ndim == 1:
+            x = x[None, :]
+        dim = self.model.data_dimensionality
+        if x.shape[1] != dim:
+            raise ValueError("Your data size != weight dim: {0}, "
+                             "expected {1}".format(x.shape[1], dim))
+
+        if streams is None:
+            streams = slice(None)
+        else:
+            streams = np.atleast_1d(streams)
+        prev = self.activation[streams]
+        if len(prev) != len(x):
+            raise ValueError("Got {0} items for {1} "
+                             "streams.".format(len(x), len(prev)))
+
+        activation = self.model.activate(x,
+                                         prev_activation=prev,
+                                         reset=self._reset[streams])
+        self.activation[streams] = activation
+        self._reset[streams] = False
+
+        return self._argfunc(activation, 1)
+
+    def run(self, X, stream=0):
+        """
+        Present consecutive items to a single stream.
+
+        Parameters
+        ----------
+        X : numpy array
+            The items, in order.
+        stream : int, optional, default 0
+            The stream to which the items belong.
+
+        Returns
+        -------
+        bmu : numpy array
+            The BMU of each item.
+
+        """
+        X = np.asarray(X, dtype=self.model.dtype)
+        bmu = np.empty(len(X), dtype=np.intp)
+        for t in range(len(X)):
+            bmu[t] = self.step(X[t:t+1], stream)[0]
+
+        return bmu
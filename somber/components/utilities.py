@@ -1,6 +1,10 @@
 """Utility functions."""
 import numpy as np
 
+from collections import OrderedDict
+
+from .data import iter_chunks
+
 
 class Scaler(object):
     """
@@ -28,44 +32,173 @@ class Scaler(object):
         self.fit(X)
         return self.transform(X)
 
-    def fit(self, X):
+    def fit(self, X, chunk_size=10000, dtype=np.float64):
         """
         Fit the scaler based on some data.
 
         Takes the columnwise mean and standard deviation of the entire input
         array.
         If the array has more than 2 dimensions, it is flattened.
+        The statistics are accumulated over chunks of rows, so X can be
+        any array-like which supports slicing, e.g. a memory-mapped array.
 
         Parameters
         ----------
         X : numpy array
+        chunk_size : int, optional, default 10000
+            The number of rows to process at the same time.
+        dtype : numpy dtype, optional, default np.float64
+            The dtype of the mean and standard deviation. The statistics
+            are always accumulated in double precision.
 
         Returns
         -------
-        scaled : numpy array
-            A scaled version of said array.
+        self : Scaler
+            The fitted scaler.
 
         """
         if X.ndim > 2:
             X = X.reshape((np.prod(X.shape[:-1]), X.shape[-1]))
-        self.mean = X.mean(0)
-        self.std = X.std(0)
+
+        count = 0
+        mean = np.zeros(X.shape[-1])
+        m2 = np.zeros(X.shape[-1])
+        for x in iter_chunks(X, chunk_size):
+            x = np.asarray(x, dtype=np.float64)
+            x_mean = x.mean(0)
+            x_m2 = ((x - x_mean) ** 2).sum(0)
+            # Combine the statistics of the chunk with the running ones.
+            delta = x_mean - mean
+            total = count + len(x)
+            mean += delta * len(x) / total
+            m2 += x_m2 + delta ** 2 * count * len(x) / total
+            count = total
+
+        self.mean = mean.astype(dtype)
+        self.std = np.sqrt(m2 / count).astype(dtype)
         self.is_fit = True
         return self
 
-    def transform(self, X):
-        """Transform your data to zero mean unit variance."""
+    def transform(self, X, out=None):
+        """
+        Transform your data to zero mean unit variance.
+
+        Parameters
+        ----------
+        X : numpy array
+            The data to transform.
+        out : numpy array, optional, default None
+            The array to write the result to, which can be X itself. If
+            this is None, a new array is allocated.
+
+        Returns
+        -------
+        scaled : numpy array
+            The scaled data.
+
+        """
         if not self.is_fit:
             raise ValueError("The scaler has not been fit yet.")
-        return (X-self.mean) / (self.std + 10e-7)
+        out = np.subtract(X, self.mean, out=out)
+        out /= (self.std + 10e-7)
+        return out
 
     def inverse_transform(self, X):
         """Invert the transformation."""
         return ((X * self.std) + self.mean)
 
 
-def shuffle(array):
-    """Gpu/cpu-agnostic shuffle function."""
-    z = array.copy()
-    np.random.shuffle(z)
-    return z
+# The distance grids of the most recently used maps, see grid_distance.
+GRID_CACHE_BYTES = 2 ** 27
+_grid_cache = OrderedDict()
+
+
+def grid_distance(map_dimensions, dtype=np.int64):
+    """
+    Calculate the squared grid distance between all neurons on a map.
+
+    The coordinates of all neurons are calculated at once, after which
+    the squared differences are summed over the axes. Because the result is
+    cached for the entire process, creating many maps with the same
+    dimensions only calculates the grid once. The returned array is
+    therefore read-only. The cached grids take up at most GRID_CACHE_BYTES;
+    the least recently used grids are evicted first, and a grid which is
+    larger than this is not cached.
+
+    Parameters
+    ----------
+    map_dimensions : tuple
+        The map size.
+    dtype : numpy dtype, optional, default np.int64
+        The dtype of the grid. If this is None, the smallest unsigned integer
+        type which can hold the largest distance is used, which saves memory
+        on large maps. Note that negating such a grid wraps around, so it
+        should be cast to a float first.
+
+    Returns
+    -------
+    grid : numpy array
+        A (num_neurons, num_neurons) array of squared grid distances.
+
+    """
+    map_dimensions = tuple(int(x) for x in map_dimensions)
+    if dtype is None:
+        dtype = np.min_scalar_type(sum((x - 1) ** 2 for x in map_dimensions))
+    dtype = np.dtype(dtype)
+
+    key = (map_dimensions, dtype)
+    try:
+        _grid_cache.move_to_end(key)
+        return _grid_cache[key]
+    except KeyError:
+        pass
+
+    num_neurons = int(np.prod(map_dimensions))
+    coords = np.unravel_index(np.arange(num_neurons), map_dimensions)
+
+    grid = np.zeros((num_neurons, num_neurons), dtype=dtype)
+    for coord in coords:
+        # Use a signed type, so that the difference can not wrap around.
+        coord = coord.astype(np.min_scalar_type(-int(coord.max()) - 1))
+        difference = np.abs(coord[:, None] - coord[None, :]).astype(dtype)
+        grid += difference * difference
+
+    grid.flags.writeable = False
+    if grid.nbytes <= GRID_CACHE_BYTES:
+        nbytes = sum(x.nbytes for x in _grid_cache.values())
+        while nbytes + grid.nbytes > GRID_CACHE_BYTES:
+            _, evicted = _grid_cache.popitem(last=False)
+            nbytes -= evicted.nbytes
+        _grid_cache[key] = grid
+
+    return grid
+
+
+def grid_offsets(map_dimensions, squared_radius):
+    """
+    Get all grid offsets within some radius on a map.
+
+    Parameters
+    ----------
+    map_dimensions : tuple
+        The map size. Offsets which do not fit on the map are left out.
+    squared_radius : float
+        The largest squared grid distance of an offset.
+
+    Returns
+    -------
+    offsets : numpy array
+        A (num_offsets, len(map_dimensions)) array of offsets.
+    squared : numpy array
+        The squared grid distance of each offset.
+
+    """
+    ranges = [np.arange(-r, r + 1)
+              for r in np.minimum(int(np.sqrt(squared_radius)),
+                                  np.asarray(map_dimensions) - 1)]
+    offsets = np.stack([g.ravel()
+                        for g in np.meshgrid(*ranges, indexing='ij')], 1)
+    squared = np.sum(offsets ** 2, 1)
+    mask = squared <= squared_radius
+
+    return offsets[mask], squared[mask]
@@ -1,9 +1,10 @@
 """Neural gas."""
 import numpy as np
-import json
 from .base import Base
 from .components.utilities import Scaler
 from .components.initializers import range_initialization
+from .components.influence import RankInfluence
+from .components.serialization import read_model
 
 
 class Ng(Base):
@@ -33,9 +34,20 @@ class Ng(Base):
     nb_lambda : float
         Controls the steepness of the exponential function that decreases
         the neighborhood.
+    dtype : numpy dtype, optional, default np.float64
+        The dtype of the weights, influences and outputs.
+    influence_epsilon : float, optional, default None
+        The smallest influence to take into account during training. If
+        this is set, only the neurons with a rank r for which
+        exp(-r / influence) >= influence_epsilon are found with a partial
+        sort, and updated. If this is None, all neurons are ranked and
+        updated.
 
     """
 
+    # Static property names
+    param_names = Base.param_names | {'influence_epsilon'}
+
     def __init__(self,
                  num_neurons,
                  learning_rate,
@@ -44,7 +56,9 @@ class Ng(Base):
                  initializer=range_initialization,
                  scaler=Scaler(),
                  lr_lambda=2.5,
-                 infl_lambda=2.5):
+                 infl_lambda=2.5,
+                 dtype=np.float64,
+                 influence_epsilon=None):
         """Organize your gas."""
         params = {'infl': {'value': influence,
                            'factor': infl_lambda,
@@ -59,29 +73,71 @@ class Ng(Base):
                          'argmin',
                          'min',
                          initializer,
-                         scaler)
+                         scaler,
+                         dtype)
+        self.influence_epsilon = influence_epsilon
 
     def _get_bmu(self, activations):
-        """Get indices of bmus, sorted by their distance from input."""
+        """
+        Get the neurons with the lowest ranks, in order of rank.
+
+        The number of ranks is that of the current influence. If this is
+        lower than the number of neurons, only those ranks are found, using
+        a partial sort.
+
+        Parameters
+        ----------
+        activations : numpy array
+            The activation of each neuron for each item.
+
+        Returns
+        -------
+        order : numpy array
+            A (batch_size, num_ranks) array containing the neurons with
+            the lowest ranks for each item.
+
+        """
         # If the neural gas is a recursive neural gas, we need reverse argsort.
         if self.argfunc == 'argmax':
             activations = -activations
-        sort = np.argsort(activations, 1)
-        return sort.argsort()
+
+        influence = self._get_influence(self.params['infl']['value'])
+        num_ranks = influence.num_ranks
+        if num_ranks >= self.num_neurons:
+            return np.argsort(activations, 1)
+
+        part = np.argpartition(activations, num_ranks - 1, 1)[:, :num_ranks]
+        order = np.argsort(np.take_along_axis(activations, part, 1), 1)
+        return np.take_along_axis(part, order, 1)
 
     def _calculate_influence(self, influence_lambda):
-        """Calculate the ranking influence."""
-        return np.exp(-np.arange(self.num_neurons) / influence_lambda)[:, None]
+        """
+        Calculate the ranking influence.
+
+        If influence_epsilon is set, the influence is truncated to the
+        ranks with an influence of at least influence_epsilon.
+        """
+        num_ranks = self.num_neurons
+        if self.influence_epsilon is not None:
+            # exp(-r / l) >= epsilon if r <= -log(epsilon) * l
+            max_rank = -np.log(self.influence_epsilon) * influence_lambda
+            num_ranks = min(num_ranks, int(max_rank) + 1)
+
+        influence = np.exp(-np.arange(num_ranks) / influence_lambda)
+        return RankInfluence(influence.astype(self.dtype), self.num_neurons)
 
     @classmethod
-    def load(cls, path):
+    def load(cls, path, mmap=True):
         """
-        Load a Neural Gas from a JSON file saved with this package.
+        Load a Neural Gas from a file saved with this package.
 
         Parameters
         ----------
         path : str
-            The path to the JSON file.
+            The path to the JSON or .npz file.
+        mmap : bool, optional, default True
+            Whether to memory-map the arrays of a .npz file, instead of
+            reading them into memory.
 
         Returns
         -------
@@ -89,19 +145,24 @@ class Ng(Base):
             A neural gas.
 
         """
-        data = json.load(open(path))
+        data = read_model(path, mmap)
 
         weights = data['weights']
-        weights = np.asarray(weights, dtype=np.float64)
+        dtype = data.get('dtype', 'float64')
+        weights = np.asarray(weights, dtype=dtype)
 
         s = cls(data['num_neurons'],
-                data['data_dimensionality'],
                 data['params']['lr']['orig'],
+                data_dimensionality=data['data_dimensionality'],
                 influence=data['params']['infl']['orig'],
                 lr_lambda=data['params']['lr']['factor'],
-                infl_lambda=data['params']['infl']['factor'])
+                infl_lambda=data['params']['infl']['factor'],
+                dtype=dtype,
+                influence_epsilon=data.get('influence_epsilon'))
 
         s.weights = weights
+        s.params = data['params']
         s.trained = True
+        s._load_scaler(data)
 
         return s
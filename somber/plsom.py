@@ -4,6 +4,7 @@ import logging
 
 from .som import BaseSom
 from .components.initializers import range_initialization
+from .components.serialization import read_model
 from tqdm import tqdm
 
 
@@ -40,6 +41,12 @@ class PLSom(BaseSom):
     scaler : initialized Scaler instance, optional default None
         An initialized instance of Scaler() which is used to scale the data
         to have mean 0 and stdev 1.
+    influence_epsilon : float, optional, default None
+        The smallest influence to take into account during training. If this
+        is set, the influence is truncated and stored sparsely as soon as
+        the neighborhood has become small enough.
+    dtype : numpy dtype, optional, default np.float64
+        The dtype of the weights, influences and outputs.
 
     Attributes
     ----------
@@ -58,14 +65,22 @@ class PLSom(BaseSom):
     param_names = {'map_dimensions',
                    'weights',
                    'data_dimensionality',
-                   'params'}
+                   'params',
+                   'beta',
+                   'influence_epsilon',
+                   'dtype'}
+
+    # The parameters depend on each batch, so batches are processed in order.
+    parallel_training = False
 
     def __init__(self,
                  map_dimensions,
                  data_dimensionality=None,
                  beta=None,
                  initializer=range_initialization,
-                 scaler=None):
+                 scaler=None,
+                 influence_epsilon=None,
+                 dtype=np.float64):
         """Organize your maps parameterlessly."""
         super().__init__(map_dimensions,
                          data_dimensionality=data_dimensionality,
@@ -75,9 +90,49 @@ class PLSom(BaseSom):
                                        'factor': 1,
                                        'orig': 0}},
                          initializer=initializer,
-                         scaler=scaler)
+                         scaler=scaler,
+                         influence_epsilon=influence_epsilon,
+                         dtype=dtype)
         self.beta = beta if beta else 2
 
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a PLSom from a file saved with this package.
+
+        Parameters
+        ----------
+        path : str
+            The path to the JSON or .npz file.
+        mmap : bool, optional, default True
+            Whether to memory-map the arrays of a .npz file, instead of
+            reading them into memory.
+
+        Returns
+        -------
+        s : cls
+            A PLSom.
+
+        """
+        data = read_model(path, mmap)
+
+        weights = data['weights']
+        dtype = data.get('dtype', 'float64')
+        weights = np.asarray(weights, dtype=dtype)
+
+        s = cls(data['map_dimensions'],
+                data_dimensionality=data['data_dimensionality'],
+                beta=data.get('beta'),
+                influence_epsilon=data.get('influence_epsilon'),
+                dtype=dtype)
+
+        s.weights = weights
+        s.params = data['params']
+        s.trained = True
+        s._load_scaler(data)
+
+        return s
+
     def _epoch(self,
                X,
                epoch_idx,
@@ -108,41 +163,63 @@ class PLSom(BaseSom):
             Whether to show a progressbar during training.
 
         """
-        # Create batches
-        X_ = self._create_batches(X, batch_size)
-        X_len = np.prod(X.shape[:-1])
+        # Create batches of indices, so that only a single batch of the
+        # data is copied at a time.
+        batches = self._create_index_batches(len(X), batch_size)
 
         # Initialize the previous activation
-        prev = self._init_prev(X_)
-        prev = self.distance_function(X_[0], self.weights)[0]
-        influences = self._update_params(prev)
+        prev = self.distance(X[batches[0]], self.weights)
 
         # Iterate over the training data
-        for idx, x in enumerate(tqdm(X_, disable=not show_progressbar)):
-
-            # Our batches are padded, so we need to
-            # make sure we know when we hit the padding
-            # so we don't inadvertently learn zeroes.
-            diff = X_len - (idx * batch_size)
-            if diff and diff < batch_size:
-                x = x[:diff]
-                # Prev_activation may be None
-                if prev is not None:
-                    prev = prev[:diff]
+        for idx, index in enumerate(tqdm(batches,
+                                         disable=not show_progressbar)):
 
             # if idx > 0 and idx % update_step == 0:
             influences = self._update_params(prev)
-            prev = self._propagate(x,
+            prev = self._propagate(X[index],
                                    influences,
                                    prev_activation=prev)
 
+    def _partial_epoch(self, X, batch_size, show_progressbar):
+        """
+        Train on a chunk in order.
+
+        The activation of the last batch is kept between calls, so that
+        the plasticity of the map continues from the previous chunk.
+        """
+        batches = self._create_index_batches(len(X),
+                                             batch_size,
+                                             shuffle_data=False)
+
+        prev = self._stream.get('prev')
+        if prev is None:
+            prev = self.distance(X[batches[0]], self.weights)
+
+        for index in tqdm(batches, disable=not show_progressbar):
+            influences = self._update_params(prev)
+            prev = self._propagate(X[index],
+                                   influences,
+                                   prev_activation=prev)
+
+        self._stream['prev'] = prev
+
     def _update_params(self, constants):
-        """Update the params."""
+        """
+        Update the params.
+
+        The influence depends on epsilon, the ratio between the current
+        error and the largest error seen so far, which changes for every
+        batch. It is therefore looked up in the influence cache on the
+        rounded value of epsilon, so that the neighborhood is only
+        calculated for values of epsilon which have not been seen before.
+        Because the influence is never dense, each batch only gathers the
+        influence rows of its BMUs.
+        """
         constants = np.max(np.min(constants, 1))
         self.params['r']['value'] = max([self.params['r']['value'],
                                          constants])
         epsilon = constants / self.params['r']['value']
-        influence = self._calculate_influence(epsilon)
+        influence = self._get_influence(epsilon)
         # Account for learning rate
         return influence * epsilon
 
@@ -150,8 +227,8 @@ class PLSom(BaseSom):
         """
         Pre-calculate the influence for a given value of sigma.
 
-        The neighborhood has size num_neurons * num_neurons, so for a
-        30 * 30 map, the neighborhood will be size (900, 900).
+        The neighborhood is scaled by the ratio between the current error
+        and the largest error seen so far, see _update_params.
 
         Parameters
         ----------
@@ -160,10 +237,9 @@ class PLSom(BaseSom):
 
         Returns
         -------
-        neighborhood : numpy array
+        neighborhood : SeparableInfluence
             The influence from each neuron to each other neuron.
 
         """
         n = (self.beta - 1) * np.log(1 + neighborhood*(np.e-1)) + 1
-        grid = np.exp((-self.distance_grid) / n**2)
-        return grid.reshape(self.num_neurons, self.num_neurons)[:, :, None]
+        return super()._calculate_influence(n)
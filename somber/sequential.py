@@ -1,15 +1,16 @@
 """The sequential SOMs."""
+import heapq
 import logging
 
-import json
 import numpy as np
 
 from tqdm import tqdm
 from .som import Som
 from .ng import Ng
-from .components.utilities import shuffle
 from .components.initializers import range_initialization
-from functools import reduce
+from .components.serialization import read_model
+from .components.data import load_data, in_memory, ChunkedArray
+from .components.session import Session
 
 logger = logging.getLogger(__name__)
 
@@ -17,67 +18,591 @@ logger = logging.getLogger(__name__)
 class SequentialMixin(object):
     """A base class for sequential SOMs, removing some code duplication."""
 
-    def _init_prev(self, X):
+    # The context depends on the previous item, so batches are processed
+    # in order.
+    parallel_training = False
+
+    # The start of each sequence in the data during fit, if any.
+    _offsets = None
+
+    def fit(self, X, *args, offsets=None, **kwargs):
+        """
+        Fit the model to one or more sequences.
+
+        The parameters are those of the fit method of the model, with one
+        addition.
+
+        Parameters
+        ----------
+        X : numpy array, np.memmap, str or list of numpy arrays
+            The input data. If this is a list of arrays, each array is
+            treated as a separate sequence.
+        offsets : numpy array, optional, default None
+            The index of the first item of each sequence in X. If this is
+            given, or if X is a list of arrays, the sequences are packed
+            into batch_size parallel streams, and the context is reset at
+            the start of each sequence, so that no context is carried over
+            from one sequence to the next. If this is None, X is a single
+            sequence, which is divided into batch_size streams.
+
+        """
+        X, self._offsets = self._get_sequences(X, offsets)
+
+        try:
+            super().fit(X, *args, **kwargs)
+        finally:
+            self._offsets = None
+
+    def _init_prev(self, num_streams):
         """Initialize the context vector for recurrent SOMs."""
-        return np.zeros((X.shape[1], self.num_neurons))
+        return np.zeros((num_streams, self.num_neurons), dtype=self.dtype)
 
-    def _create_batches(self, X, batch_size, shuffle_data=False):
+    def _get_sequences(self, X, offsets):
         """
-        Create batches out of a sequence of data.
+        Get the data, and the start of each sequence in it, if any.
 
-        This function will append zeros to the end of your data to ensure that
-        all batches are even-sized. These are masked out during training.
+        A list of sequences which are all in memory is concatenated once,
+        so that the items of each step are read from a single array. Only
+        memory-mapped sequences are read per step.
         """
-        if shuffle_data:
-            X = shuffle(X)
+        X = load_data(X)
+        if (isinstance(X, ChunkedArray)
+                and all(in_memory(x) for x in X.chunks)):
+            if offsets is None:
+                offsets = X.offsets[:-1]
+            X = np.asarray(X)
+        return X, self._get_offsets(X, offsets)
+
+    def _get_offsets(self, X, offsets):
+        """Get and check the start of each sequence in X, if any."""
+        if offsets is None:
+            if isinstance(X, ChunkedArray):
+                return X.offsets[:-1]
+            return None
+
+        offsets = np.asarray(offsets, dtype=np.intp)
+        if (offsets.ndim != 1 or not len(offsets) or offsets[0] != 0
+                or np.any(np.diff(offsets) < 0) or offsets[-1] > len(X)):
+            raise ValueError("offsets should be an increasing array of "
+                             "indices into X which starts at 0.")
+        return offsets
+
+    def _create_batches(self, num_items, batch_size, offsets=None):
+        """
+        Create the batches of a sequence, or of several sequences.
+
+        Parameters
+        ----------
+        num_items : int
+            The number of items in the data.
+        batch_size : int
+            The number of parallel streams.
+        offsets : numpy array, optional, default None
+            The index of the first item of each sequence. If this is None,
+            the data is a single sequence.
+
+        Returns
+        -------
+        batches : list of slices or numpy arrays
+            The indices of the items at each time step.
+        starts : numpy array or None
+            Whether each item is the first item of a sequence, or None if
+            the data is a single sequence.
+
+        """
+        if offsets is None:
+            return self._create_index_batches(num_items, batch_size), None
+        return self._pack_sequences(num_items, batch_size, offsets)
+
+    def _pack_sequences(self, num_items, batch_size, offsets):
+        """
+        Pack sequences into parallel streams, and create a batch per step.
+
+        Each sequence is placed in its entirety in a single stream. The
+        sequences are assigned from longest to shortest, each to the stream
+        which is shortest at that point, so that the streams have about the
+        same length, and all streams are busy for almost all steps. The
+        streams are then ordered from longest to shortest, so that, like
+        in _create_index_batches, the streams which have not ended are
+        always the first ones.
+
+        Parameters
+        ----------
+        num_items : int
+            The number of items in the data.
+        batch_size : int
+            The number of parallel streams.
+        offsets : numpy array
+            The index of the first item of each sequence.
 
-        if batch_size > X.shape[0]:
-            batch_size = X.shape[0]
+        Returns
+        -------
+        batches : list of numpy arrays
+            The indices of the items at each time step.
+        starts : numpy array
+            Whether each item is the first item of a sequence.
 
-        max_x = int(np.ceil(X.shape[0] / batch_size))
-        # This line first resizes the data to
-        X = np.resize(X, (batch_size, max_x, X.shape[1]))
-        # Transposes it to (len(X) / batch_size, batch_size, data_dim)
+        """
+        lengths = np.diff(np.append(offsets, num_items))
+        batch_size = max(min(batch_size, len(lengths)), 1)
+
+        stream_of = np.empty(len(lengths), dtype=np.intp)
+        start_of = np.empty(len(lengths), dtype=np.intp)
+        # A heap of the length of each stream so far.
+        streams = [(0, stream) for stream in range(batch_size)]
+        order = np.argsort(-lengths, kind='stable')
+        for seq, length in zip(order.tolist(), lengths[order].tolist()):
+            start, stream = streams[0]
+            stream_of[seq] = stream
+            start_of[seq] = start
+            heapq.heapreplace(streams, (start + length, stream))
+
+        stream_lengths = np.zeros(batch_size, dtype=np.intp)
+        for length, stream in streams:
+            stream_lengths[stream] = length
+        order = np.argsort(-stream_lengths, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(batch_size)
+        stream_lengths = stream_lengths[order]
+
+        # The step and stream of each item.
+        sequence = np.repeat(np.arange(len(lengths)), lengths)
+        step = np.arange(num_items) - offsets[sequence]
+        starts = step == 0
+        step += start_of[sequence]
+
+        num_steps = stream_lengths[0]
+        schedule = np.empty((num_steps, batch_size), dtype=np.intp)
+        schedule[step, rank[stream_of[sequence]]] = np.arange(num_items)
+        # The number of streams which have not ended at each step.
+        active = np.searchsorted(-stream_lengths,
+                                 -np.arange(num_steps),
+                                 side='left')
+
+        return [schedule[t, :active[t]] for t in range(num_steps)], starts
+
+    def _step_context(self, prev, batch_length, index, starts, step):
+        """
+        Get the context of a batch from the activation of the previous batch.
 
-        return X.transpose((1, 0, 2))
+        Streams which have ended are dropped from the context, and the
+        context of the streams in which a new sequence starts is reset.
+
+        Parameters
+        ----------
+        prev : numpy array
+            The activation of the previous batch.
+        batch_length : int
+            The number of items in the batch.
+        index : slice or numpy array
+            The indices of the items in the batch.
+        starts : numpy array or None
+            Whether each item is the first item of a sequence, see
+            _create_batches.
+        step : int
+            The time step of the batch.
+
+        Returns
+        -------
+        prev : numpy array
+            The activation of the previous item of each stream.
+        reset : numpy array
+            Whether each item is the first item of its stream, i.e. has no
+            previous item.
+
+        """
+        prev = prev[:batch_length]
+        if starts is not None:
+            reset = starts[index]
+        else:
+            reset = np.full(batch_length, step == 0)
+        prev[reset] = 0
+        return prev, reset
+
+    def _create_index_batches(self,
+                              num_items,
+                              batch_size,
+                              shuffle_data=False):
+        """
+        Divide a sequence into parallel streams, and create a batch per step.
+
+        The sequence is divided into batch_size consecutive streams of
+        equal length. The batch for time step t contains the t-th item of
+        each stream, i.e. every stream_length-th item starting at t, so it
+        is a strided slice of the data, and no data is copied. If the data
+        can not be divided evenly, the last streams are shorter, and the
+        last batches only contain the streams which have not ended yet.
+        Because these are always the first streams, the context for a batch
+        is the first len(batch) rows of the previous activation.
+
+        Parameters
+        ----------
+        num_items : int
+            The number of items in the data.
+        batch_size : int
+            The number of parallel streams.
+        shuffle_data : bool, optional, default False
+            Whether to shuffle the items before dividing them into streams.
+
+        Returns
+        -------
+        batches : list of slices or numpy arrays
+            The indices of the items at each time step.
+
+        """
+        batch_size = max(min(batch_size, num_items), 1)
+        stream_length = int(np.ceil(num_items / batch_size))
+
+        if shuffle_data:
+            indices = np.random.permutation(num_items)
+            return [indices[t::stream_length] for t in range(stream_length)]
+
+        return [slice(t, num_items, stream_length)
+                for t in range(stream_length)]
+
+    def _epoch(self,
+               X,
+               epoch_idx,
+               batch_size,
+               updates_epoch,
+               constants,
+               show_progressbar):
+        """
+        Run a single epoch.
+
+        Parameters
+        ----------
+        X : numpy array
+            The training data.
+        epoch_idx : int
+            The current epoch
+        batch_size : int
+            The batch size
+        updates_epoch : int
+            The number of updates to perform per epoch
+        constants : dict
+            A dictionary containing the constants with which to update the
+            parameters in self.parameters.
+        show_progressbar : bool
+            Whether to show a progressbar during training.
+
+        """
+        # Create batches of indices, so that only a single batch of the
+        # data is copied at a time.
+        batches, starts = self._create_batches(len(X),
+                                               batch_size,
+                                               self._offsets)
+
+        update_step = np.ceil(len(batches) / updates_epoch)
+
+        # Initialize the previous activation
+        prev = self._init_prev(batch_size)
+        influences = self._update_params(constants)
+
+        # Iterate over the training data
+        for idx, index in enumerate(tqdm(batches,
+                                         disable=not show_progressbar)):
+            x = X[index]
+
+            # If we hit an update step, perform an update.
+            if idx % update_step == 0:
+                influences = self._update_params(constants)
+                logger.info(self.params)
+
+            prev, reset = self._step_context(prev,
+                                             len(x),
+                                             index,
+                                             starts,
+                                             idx)
+            prev = self._propagate(x,
+                                   influences,
+                                   prev_activation=prev,
+                                   reset=reset)
 
     def forward(self, x, **kwargs):
         """Do a forward pass."""
         raise ValueError("Base class.")
 
-    def predict_distance(self, X, batch_size=1, show_progressbar=False):
-        """Predict distances to some input data."""
+    def predict_distance(self,
+                         X,
+                         batch_size=1,
+                         show_progressbar=False,
+                         out=None,
+                         offsets=None):
+        """
+        Predict distances to some input data.
+
+        Parameters
+        ----------
+        X : numpy array.
+            The input data.
+        batch_size : int, optional, default 1
+            The number of parallel streams the data is divided into.
+        show_progressbar : bool
+            Whether to show a progressbar.
+        out : numpy array, optional, default None
+            A (len(X), num_neurons) array to write the result to. If this
+            is None, a new array is allocated.
+        offsets : numpy array, optional, default None
+            The index of the first item of each sequence in X, see fit.
+
+        Returns
+        -------
+        activations : numpy array
+            The activation of each neuron for each input.
+
+        """
+        X, offsets = self._get_sequences(X, offsets)
         X = self._check_input(X)
+        out = self._check_output(X, out)
+
+        batches, starts = self._create_batches(len(X), batch_size, offsets)
+
+        activation = self._init_prev(batch_size)
+        for step, index in enumerate(tqdm(batches,
+                                          disable=not show_progressbar)):
+            x = X[index]
+            activation, reset = self._step_context(activation,
+                                                   len(x),
+                                                   index,
+                                                   starts,
+                                                   step)
+            activation = self.activate(x,
+                                       prev_activation=activation,
+                                       reset=reset)
+            out[index] = activation
+
+        return out
+
+    def session(self, num_streams=1):
+        """
+        Start a session, to which items can be presented as they arrive.
 
-        X_shape = reduce(np.multiply, X.shape[:-1], 1)
+        Unlike predict_distance, which processes a complete sequence, a
+        session keeps the activation of each of its streams between calls.
+        See somber.components.session.Session.
 
-        batched = self._create_batches(X, batch_size, shuffle_data=False)
+        Parameters
+        ----------
+        num_streams : int, optional, default 1
+            The number of independent streams in the session.
+
+        Returns
+        -------
+        session : Session
+            The session.
+
+        """
+        if not self.trained:
+            raise ValueError("The model has not been trained yet.")
+        return Session(self, num_streams)
+
+    def partial_fit(self, X, **kwargs):
+        """Not available, because the context of a stream can not be split."""
+        raise ValueError("{0} can not be trained with "
+                         "partial_fit.".format(type(self).__name__))
+
+    def transform(self,
+                  X,
+                  batch_size=100,
+                  show_progressbar=False,
+                  n_jobs=1,
+                  out=None):
+        """
+        Transform input to a matrix of activations.
+
+        Because the activation depends on the previous item, this is the
+        same as predict_distance, and can only use a single thread.
+        """
+        if n_jobs != 1:
+            raise ValueError("Sequential models can only be transformed "
+                             "in a single thread.")
+        return self.predict_distance(X, batch_size, show_progressbar, out)
+
+    def iter_predict(self, X, chunk_size=1024, n_jobs=1):
+        """
+        Predict the BMU and its activation for each input, chunk by chunk.
+
+        The data is treated as a single stream, and the activation of the
+        last item of a chunk is used as context for the next chunk.
+
+        Parameters
+        ----------
+        X : numpy array.
+            The input data.
+        chunk_size : int, optional, default 1024
+            The number of items per chunk.
+        n_jobs : int, optional, default 1
+            Must be 1, see transform.
+
+        Yields
+        ------
+        bmu : numpy array
+            The BMU of each item in the chunk.
+        value : numpy array
+            The activation of the BMU of each item in the chunk.
+
+        """
+        if n_jobs != 1:
+            raise ValueError("Sequential models can only be transformed "
+                             "in a single thread.")
+        X = self._check_input(X)
+        activation = self._init_prev(1)
+
+        for idx in range(0, len(X), chunk_size):
+            x = X[idx:idx+chunk_size]
+            bmu = np.empty(len(x), dtype=np.intp)
+            value = np.empty(len(x), dtype=self.dtype)
+            for t in range(len(x)):
+                reset = np.array([idx + t == 0])
+                activation = self.activate(x[t:t+1],
+                                           prev_activation=activation,
+                                           reset=reset)
+                bmu[t] = activation[0].__getattribute__(self.argfunc)()
+                value[t] = activation[0, bmu[t]]
+            yield bmu, value
+
+    def _predict(self, X, batch_size, show_progressbar=False, n_jobs=1):
+        """
+        Get the BMU and its activation for each input.
 
-        activations = []
+        Like predict_distance, the data is divided into batch_size parallel
+        streams, but only the BMUs are stored. If X is a list of arrays,
+        each array is a separate sequence.
+        """
+        if n_jobs != 1:
+            raise ValueError("Sequential models can only be transformed "
+                             "in a single thread.")
+        X, offsets = self._get_sequences(X, None)
+        X = self._check_input(X)
+        batches, starts = self._create_batches(len(X), batch_size, offsets)
+
+        bmu = np.empty(len(X), dtype=np.intp)
+        value = np.empty(len(X), dtype=self.dtype)
+
+        activation = self._init_prev(batch_size)
+        for step, index in enumerate(tqdm(batches,
+                                          disable=not show_progressbar)):
+            x = X[index]
+            activation, reset = self._step_context(activation,
+                                                   len(x),
+                                                   index,
+                                                   starts,
+                                                   step)
+            activation = self.activate(x,
+                                       prev_activation=activation,
+                                       reset=reset)
+            b = activation.__getattribute__(self.argfunc)(1)
+            bmu[index] = b
+            value[index] = activation[np.arange(len(x)), b]
+
+        return bmu, value
+
+    def generate(self,
+                 num_to_generate,
+                 starting_place,
+                 top_k=None,
+                 temperature=1.0,
+                 out=None):
+        """
+        Generate data based on some initial position.
+
+        At each step, the weights of the neuron chosen in the previous step
+        are presented to the model. All trajectories are advanced together,
+        with a single forward pass per step.
 
-        activation = self._init_prev(batched)
+        Parameters
+        ----------
+        num_to_generate : int
+            The number of steps to generate.
+        starting_place : numpy array
+            The activation from which to start, or a (num_trajectories,
+            num_neurons) array containing an activation per trajectory.
+        top_k : int, optional, default None
+            If this is None, the neuron with the highest activation is
+            chosen at each step. Otherwise, a neuron is sampled from the
+            top_k neurons with the highest activation, with a probability
+            proportional to activation ** (1 / temperature).
+        temperature : float, optional, default 1.0
+            The temperature with which to sample. Lower temperatures make
+            the neurons with the highest activation more likely.
+        out : numpy array, optional, default None
+            A (num_trajectories, num_to_generate) array of integers to
+            write the result to. If this is None, a new array is allocated.
 
-        for x in tqdm(batched, disable=not show_progressbar):
-            activation = self.forward(x, prev_activation=activation)[0]
-            activations.append(activation)
+        Returns
+        -------
+        indices : numpy array
+            The neuron chosen at each step. If starting_place is a single
+            activation, this is a (num_to_generate,) array, otherwise it is
+            a (num_trajectories, num_to_generate) array.
 
-        act = np.asarray(activations, dtype=np.float64).transpose((1, 0, 2))
-        act = act[:X_shape]
-        return act.reshape(X_shape, self.num_neurons)
+        """
+        activ = np.asarray(starting_place, dtype=self.dtype)
+        single = activ.ndim == 1
+        if single:
+            activ = activ[None, :]
+
+        if out is None:
+            out = np.empty((len(activ), num_to_generate), dtype=np.intp)
+        elif out.shape != (len(activ), num_to_generate):
+            raise ValueError("out should have shape {0}, got "
+                             "{1}".format((len(activ), num_to_generate),
+                                          out.shape))
 
-    def generate(self, num_to_generate, starting_place):
-        """Generate data based on some initial position."""
-        res = []
-        activ = starting_place[None, :]
         index = activ.__getattribute__(self.argfunc)(1)
         item = self.weights[index]
-        for x in range(num_to_generate):
-            activ = self.forward(item, prev_activation=activ)[0]
-            index = activ.__getattribute__(self.argfunc)(1)
-            res.append(index)
-            item = self.weights[index]
+        for t in range(num_to_generate):
+            activ = self.activate(item, prev_activation=activ)
+            if top_k is None:
+                index = activ.__getattribute__(self.argfunc)(1)
+            else:
+                index = self._sample(activ, top_k, temperature)
+            out[:, t] = index
+            np.take(self.weights, index, axis=0, out=item)
+
+        if single:
+            return out[0]
+        return out
+
+    def _sample(self, activations, top_k, temperature):
+        """
+        Sample a neuron from the top_k most active neurons of each row.
 
-        return res
+        Parameters
+        ----------
+        activations : numpy array
+            The activation of each neuron for each trajectory.
+        top_k : int
+            The number of neurons to sample from.
+        temperature : float
+            The temperature with which to sample.
+
+        Returns
+        -------
+        indices : numpy array
+            The sampled neuron for each trajectory.
+
+        """
+        top_k = min(top_k, activations.shape[1])
+        top = np.argpartition(-activations, top_k - 1, 1)[:, :top_k]
+
+        # Sample with probabilities proportional to
+        # activation ** (1 / temperature), normalized in log space so
+        # that small activations do not underflow.
+        logits = np.take_along_axis(activations, top, 1)
+        np.maximum(logits, np.finfo(logits.dtype).tiny, out=logits)
+        np.log(logits, out=logits)
+        logits /= temperature
+        logits -= logits.max(1)[:, None]
+        probabilities = np.exp(logits, out=logits)
+        cumulative = np.cumsum(probabilities, 1)
+
+        threshold = np.random.rand(len(top), 1) * cumulative[:, -1:]
+        choice = (cumulative < threshold).sum(1)
+        np.minimum(choice, top_k - 1, out=choice)
+
+        return top[np.arange(len(top)), choice]
 
 
 class RecursiveMixin(SequentialMixin):
@@ -141,26 +666,45 @@ class RecursiveMixin(SequentialMixin):
                    'weights',
                    'context_weights',
                    'alpha',
-                   'beta'}
+                   'beta',
+                   'dtype'}
+
+    def _init_context_weights(self):
+        """Create the context weights, which store an activation per neuron."""
+        return np.zeros((self.num_neurons, self.num_neurons),
+                        dtype=self.dtype)
+
+    def _context(self, prev, reset=None):
+        """
+        Get the context of a batch, which is compared to the context weights.
+
+        Parameters
+        ----------
+        prev : numpy array
+            The activation of the network in the previous time-step.
+        reset : numpy array, optional, default None
+            Whether each item is the first item of its stream. The previous
+            activation of these items is all zeros, which is their context.
+
+        Returns
+        -------
+        context : numpy array
+            The context of each item.
+
+        """
+        return prev
 
     def _propagate(self, x, influences, **kwargs):
-        prev = kwargs['prev_activation']
-
-        activation, diff_x, diff_y = self.forward(x, prev_activation=prev)
-        x_update, y_update = self.backward(diff_x,
-                                           influences,
-                                           activation,
-                                           diff_y=diff_y)
-        # If batch size is 1 we can leave out the call to mean.
-        if x_update.shape[0] == 1:
-            self.weights += x_update[0]
-        else:
-            self.weights += x_update.mean(0)
+        context = self._context(kwargs['prev_activation'],
+                                kwargs.get('reset'))
 
-        if y_update.shape[0] == 1:
-            self.context_weights += y_update[0]
-        else:
-            self.context_weights += y_update.mean(0)
+        activation = self._activate_context(x, context)
+        neurons, x_update, y_update = self.backward(x,
+                                                    influences,
+                                                    activation,
+                                                    context=context)
+        self.weights[neurons] += x_update
+        self.context_weights[neurons] += y_update
 
         return activation
 
@@ -170,6 +714,36 @@ class RecursiveMixin(SequentialMixin):
 
         The forward pass in recursive som is based on a combination between
         the activation in the last time-step and the current time-step.
+        Because the update is calculated from the inputs and contexts in
+        backward, the differences between the inputs and the weights are
+        not needed, so this is the same as activate.
+
+        Parameters
+        ----------
+        x : numpy array
+            The input data.
+        prev_activation : numpy array.
+            The activation of the network in the previous time-step.
+        reset : numpy array, optional, default None
+            Whether each item is the first item of its stream, i.e. has no
+            previous activation.
+
+        Returns
+        -------
+        activations : numpy array
+            The activation of each unit.
+
+        """
+        return self.activate(x, **kwargs)
+
+    def activate(self, x, **kwargs):
+        """
+        Get the activations of the network.
+
+        Both the distance to the weights and the distance to the context
+        weights are calculated with a single matrix multiplication, so the
+        (batch_size, neurons, neurons) difference tensor of the context is
+        never created.
 
         Parameters
         ----------
@@ -177,32 +751,83 @@ class RecursiveMixin(SequentialMixin):
             The input data.
         prev_activation : numpy array.
             The activation of the network in the previous time-step.
+        reset : numpy array, optional, default None
+            Whether each item is the first item of its stream, i.e. has no
+            previous activation.
+
+        Returns
+        -------
+        activations : numpy array
+            The activation of each unit.
+
+        """
+        context = self._context(kwargs['prev_activation'],
+                                kwargs.get('reset'))
+        return self._activate_context(x, context)
+
+    def _activate_context(self, x, context):
+        """Get the activations of the network given the context."""
+        activation = self.distance(x, self.weights)
+        activation *= self.alpha
+        distance_y = self.distance(context, self.context_weights)
+        distance_y *= self.beta
+        activation += distance_y
+        np.negative(activation, out=activation)
+
+        return np.exp(activation, out=activation)
+
+    def backward(self, x, influences, activations, **kwargs):
+        """
+        Backward pass through the network, including update.
+
+        The updates of the weights and the context weights are calculated
+        like the update in Base.backward: the inputs and the contexts are
+        weighted by the influence rows of the BMUs in a single matrix
+        product, so the memory needed does not depend on the batch size.
+
+        Parameters
+        ----------
+        x : numpy array
+            The input data.
+        influences : influence instance
+            An instance of one of the classes in somber.components.influence,
+            containing the influence each neuron has on each other neuron.
+            This is used to calculate the updates.
+        activations : numpy array
+            The activations each neuron has to each data point. This is used
+            to calculate the BMU.
+        context : numpy array
+            The context of each item, as returned by _context.
 
         Returns
         -------
-        activations : tuple of activations and differences
-            A tuple containing the activation of each unit, the differences
-            between the weights and input and the differences between the
-            context input and context weights.
+        neurons : slice or numpy array
+            The neurons to update.
+        x_update : numpy array
+            The mean update to the weights of these neurons.
+        y_update : numpy array
+            The mean update to the context weights of these neurons.
 
         """
-        prev = kwargs['prev_activation']
+        context = kwargs['context']
+        bmu = self._get_bmu(activations)
 
-        # Differences is the components of the weights subtracted from
-        # the weight vector.
-        distance_x, diff_x = self.distance_function(x, self.weights)
-        distance_y, diff_y = self.distance_function(prev, self.context_weights)
+        # The inputs and contexts share the influence, so their statistics
+        # are calculated together.
+        neurons, weighted, total = influences.statistics(
+            bmu, np.concatenate([x, context], 1))
+        weighted_x = weighted[:, :x.shape[1]]
+        weighted_y = weighted[:, x.shape[1]:]
 
-        x_ = distance_x * self.alpha
-        y_ = distance_y * self.beta
-        activation = np.exp(-(x_ + y_))
+        x_update = weighted_x - total[:, None] * self.weights[neurons]
+        y_update = weighted_y - total[:, None] * self.context_weights[neurons]
 
-        return activation, diff_x, diff_y
+        return neurons, x_update / len(x), y_update / len(x)
 
     @classmethod
-    def load(cls, path):
+    def load(cls, path, mmap=True):
         """
-        Load a recursive SOM from a JSON file.
+        Load a recursive SOM from a file saved with this package.
 
         You can use this function to load weights of other SOMs.
         If there are no context weights, they will be set to 0.
@@ -210,7 +835,10 @@ class RecursiveMixin(SequentialMixin):
         Parameters
         ----------
         path : str
-            The path to the JSON file.
+            The path to the JSON or .npz file.
+        mmap : bool, optional, default True
+            Whether to memory-map the arrays of a .npz file, instead of
+            reading them into memory.
 
         Returns
         -------
@@ -218,17 +846,11 @@ class RecursiveMixin(SequentialMixin):
             A som of the specified class.
 
         """
-        data = json.load(open(path))
+        data = read_model(path, mmap)
 
         weights = data['weights']
-        weights = np.asarray(weights, dtype=np.float64)
-
-        try:
-            context_weights = data['context_weights']
-            context_weights = np.asarray(context_weights,
-                                         dtype=np.float64)
-        except KeyError:
-            context_weights = np.zeros((len(weights), len(weights)))
+        dtype = data.get('dtype', 'float64')
+        weights = np.asarray(weights, dtype=dtype)
 
         try:
             alpha = data['alpha']
@@ -238,24 +860,38 @@ class RecursiveMixin(SequentialMixin):
             beta = 1.0
 
         s = cls(data['map_dimensions'],
-                data['data_dimensionality'],
                 data['params']['lr']['orig'],
-                influence=data['params']['infl']['orig'],
                 alpha=alpha,
                 beta=beta,
+                data_dimensionality=data['data_dimensionality'],
+                influence=data['params']['infl']['orig'],
                 lr_lambda=data['params']['lr']['factor'],
-                infl_lambda=data['params']['infl']['factor'])
+                infl_lambda=data['params']['infl']['factor'],
+                dtype=dtype)
 
         s.weights = weights
-        s.context_weights = context_weights
+        s.params = data['params']
+        s._load_context(data)
         s.trained = True
+        s._load_scaler(data)
 
         return s
 
+    def _load_context(self, data):
+        """Restore the context weights saved with a model, if any."""
+        if 'context_weights' in data:
+            self.context_weights = np.asarray(data['context_weights'],
+                                              dtype=self.dtype)
+        elif self.context_weights is None:
+            self.context_weights = self._init_context_weights()
+
 
 class RecursiveSom(RecursiveMixin, Som):
     """Recursive version of the SOM."""
 
+    # The batch SOM can not model context, so only online training is allowed.
+    modes = ("online",)
+
     def __init__(self,
                  map_dimensions,
                  learning_rate,
@@ -266,7 +902,8 @@ class RecursiveSom(RecursiveMixin, Som):
                  initializer=range_initialization,
                  scaler=None,
                  lr_lambda=2.5,
-                 infl_lambda=2.5):
+                 infl_lambda=2.5,
+                 dtype=np.float64):
         """Organize your maps recursively."""
         super().__init__(map_dimensions,
                          learning_rate,
@@ -275,53 +912,31 @@ class RecursiveSom(RecursiveMixin, Som):
                          initializer,
                          scaler,
                          lr_lambda,
-                         infl_lambda)
+                         infl_lambda,
+                         dtype=dtype)
 
         self.alpha = alpha
         self.beta = beta
         self.argfunc = 'argmax'
         self.valfunc = 'max'
 
-        self.context_weights = np.zeros((self.num_neurons, self.num_neurons),
-                                        dtype=np.float64)
-
-    def backward(self, diff_x, influences, activations, **kwargs):
-        """
-        Backward pass through the network, including update.
-
-        Parameters
-        ----------
-        diff_x : numpy array
-            A matrix containing the differences between the input and neurons.
-        influences : numpy array
-            A matrix containing the influence each neuron has on each
-            other neuron. This is used to calculate the updates.
-        activations : numpy array
-            The activations each neuron has to each data point. This is used
-            to calculate the BMU.
-        differency_y : numpy array
-            The differences between the input and context neurons.
-
-        Returns
-        -------
-        updates : tuple of arrays
-            The updates to the weights and context weights, respectively.
-
-        """
-        diff_y = kwargs['diff_y']
-        bmu = self._get_bmu(activations)
-        influence = influences[bmu]
-
-        # Update
-        x_update = np.multiply(diff_x, influence)
-        y_update = np.multiply(diff_y, influence)
-
-        return x_update, y_update
+        self.context_weights = self._init_context_weights()
 
 
 class RecursiveNg(RecursiveMixin, Ng):
     """Recursive version of the neural gas."""
 
+    param_names = {'data_dimensionality',
+                   'params',
+                   'num_neurons',
+                   'valfunc',
+                   'argfunc',
+                   'weights',
+                   'context_weights',
+                   'alpha',
+                   'beta',
+                   'dtype'}
+
     def __init__(self,
                  num_neurons,
                  data_dimensionality,
@@ -332,54 +947,236 @@ class RecursiveNg(RecursiveMixin, Ng):
                  initializer=range_initialization,
                  scaler=None,
                  lr_lambda=2.5,
-                 infl_lambda=2.5):
+                 infl_lambda=2.5,
+                 dtype=np.float64):
         """Organize your gas recursively."""
         super().__init__(num_neurons,
-                         data_dimensionality,
                          learning_rate,
-                         influence,
-                         initializer,
-                         scaler,
-                         lr_lambda,
-                         infl_lambda)
+                         influence=influence,
+                         data_dimensionality=data_dimensionality,
+                         initializer=initializer,
+                         scaler=scaler,
+                         lr_lambda=lr_lambda,
+                         infl_lambda=infl_lambda,
+                         dtype=dtype)
 
         self.alpha = alpha
         self.beta = beta
         self.argfunc = 'argmax'
         self.valfunc = 'max'
 
-        self.context_weights = np.zeros((self.num_neurons, self.num_neurons),
-                                        dtype=np.float64)
+        self.context_weights = self._init_context_weights()
 
-    def backward(self, diff_x, influences, activations, **kwargs):
+    @classmethod
+    def load(cls, path, mmap=True):
         """
-        Backward pass through the network, including update.
+        Load a recursive neural gas from a file saved with this package.
+
+        If there are no context weights, they will be set to 0.
 
         Parameters
         ----------
-        diff_x : numpy array
-            A matrix containing the differences between the input and neurons.
-        influences : numpy array
-            A matrix containing the influence each neuron has on each
-            other neuron. This is used to calculate the updates.
-        activations : numpy array
-            The activations each neuron has to each data point. This is used
-            to calculate the BMU.
-        differency_y : numpy array
-            The differences between the input and context neurons.
+        path : str
+            The path to the JSON or .npz file.
+        mmap : bool, optional, default True
+            Whether to memory-map the arrays of a .npz file, instead of
+            reading them into memory.
 
         Returns
         -------
-        updates : tuple of arrays
-            The updates to the weights and context weights, respectively.
+        s : cls
+            A neural gas of the specified class.
 
         """
-        diff_y = kwargs['diff_y']
-        bmu = self._get_bmu(activations)
-        influence = influences[bmu]
+        data = read_model(path, mmap)
+
+        weights = data['weights']
+        dtype = data.get('dtype', 'float64')
+        weights = np.asarray(weights, dtype=dtype)
+
+        s = cls(data['num_neurons'],
+                data['data_dimensionality'],
+                data['params']['lr']['orig'],
+                alpha=data['alpha'],
+                beta=data['beta'],
+                influence=data['params']['infl']['orig'],
+                lr_lambda=data['params']['lr']['factor'],
+                infl_lambda=data['params']['infl']['factor'],
+                dtype=dtype)
+
+        s.weights = weights
+        s.params = data['params']
+        s._load_context(data)
+        s.trained = True
+        s._load_scaler(data)
+
+        return s
+
+
+class MergeMixin(RecursiveMixin):
+    """
+    A Merge Mixin.
+
+    Like a recursive model, a merge model stores which exemplars preceded
+    each neuron in context weights. Instead of the entire activation of the
+    previous time-step, the context is the merge of the weights and the
+    context weights of the BMU in the previous time-step, as in the Merge
+    SOM. The context therefore has the same dimensionality as the input,
+    so the memory and computation needed are linear in the number of
+    neurons, instead of quadratic.
+
+    The context of the first item of a stream, which is marked by the reset
+    mask that is passed along with the previous activation, is the zero
+    vector in the space of the scaled data. Like the weights, the context
+    weights are scaled back to the space of the data after training.
+
+    Parameters
+    ----------
+    merge : float, optional, default .5
+        The weight of the context weights of the previous BMU in the
+        context. The weight of its weights is 1 - merge.
+
+    Attributes
+    ----------
+    context_weights : numpy array
+        A (num_neurons, data_dimensionality) array containing the context
+        of each neuron.
+
+    """
+
+    param_names = RecursiveMixin.param_names | {'merge'}
+
+    def _init_context_weights(self):
+        """Create the context weights, which store an input per neuron."""
+        if self.weights is None:
+            return None
+        return np.zeros_like(self.weights)
+
+    def _init_weights(self, X):
+        """Set the weights and context weights before starting training."""
+        X = super()._init_weights(X)
+        self.context_weights = self._init_context_weights()
+        return X
+
+    def _transform_weights(self):
+        """Scale the weights and the context weights, which are inputs."""
+        super()._transform_weights()
+        if self.scaler is not None:
+            self.context_weights = self.scaler.transform(self.context_weights)
+
+    def _inverse_transform_weights(self):
+        """Scale the weights and the context weights back."""
+        super()._inverse_transform_weights()
+        if self.scaler is not None:
+            self.context_weights = self.scaler.inverse_transform(
+                self.context_weights)
+
+    def _context(self, prev, reset=None):
+        """
+        Get the context of a batch, which is compared to the context weights.
+
+        Parameters
+        ----------
+        prev : numpy array
+            The activation of the network in the previous time-step.
+        reset : numpy array, optional, default None
+            Whether each item is the first item of its stream. These items
+            have no previous BMU, so their context is empty.
 
-        # Update
-        x_update = np.multiply(diff_x, influence)
-        y_update = np.multiply(diff_y, influence)
+        Returns
+        -------
+        context : numpy array
+            The merged weights and context weights of the previous BMU of
+            each item.
+
+        """
+        bmu = prev.__getattribute__(self.argfunc)(1)
+
+        context = self.weights[bmu]
+        context *= 1 - self.merge
+        context += self.merge * self.context_weights[bmu]
+        if reset is not None:
+            context[reset] = self._empty_context()
+
+        return context
+
+    def _empty_context(self):
+        """
+        Get the context of the first item of a stream.
 
-        return x_update, y_update
+        This is the zero vector in the space of the scaled data, so once the
+        weights have been scaled back after training, it is the mean of the
+        data.
+        """
+        if self.scaler is None or self._weights_scaled:
+            return 0
+        return self.scaler.mean
+
+    def _load_context(self, data):
+        """Restore the context weights and the merge parameter."""
+        super()._load_context(data)
+        self.merge = data.get('merge', self.merge)
+
+
+class MergeSom(MergeMixin, RecursiveSom):
+    """Merge version of the SOM."""
+
+    def __init__(self,
+                 map_dimensions,
+                 learning_rate,
+                 alpha,
+                 beta,
+                 data_dimensionality=None,
+                 influence=None,
+                 initializer=range_initialization,
+                 scaler=None,
+                 lr_lambda=2.5,
+                 infl_lambda=2.5,
+                 dtype=np.float64,
+                 merge=.5):
+        """Organize your maps mergingly."""
+        super().__init__(map_dimensions,
+                         learning_rate,
+                         alpha,
+                         beta,
+                         data_dimensionality=data_dimensionality,
+                         influence=influence,
+                         initializer=initializer,
+                         scaler=scaler,
+                         lr_lambda=lr_lambda,
+                         infl_lambda=infl_lambda,
+                         dtype=dtype)
+        self.merge = merge
+
+
+class MergeNg(MergeMixin, RecursiveNg):
+    """Merge version of the neural gas."""
+
+    param_names = RecursiveNg.param_names | {'merge'}
+
+    def __init__(self,
+                 num_neurons,
+                 data_dimensionality,
+                 learning_rate,
+                 alpha,
+                 beta,
+                 influence,
+                 initializer=range_initialization,
+                 scaler=None,
+                 lr_lambda=2.5,
+                 infl_lambda=2.5,
+                 dtype=np.float64,
+                 merge=.5):
+        """Organize your gas mergingly."""
+        super().__init__(num_neurons,
+                         data_dimensionality,
+                         learning_rate,
+                         alpha,
+                         beta,
+                         influence,
+                         initializer=initializer,
+                         scaler=scaler,
+                         lr_lambda=lr_lambda,
+                         infl_lambda=infl_lambda,
+                         dtype=dtype)
+        self.merge = merge
@@ -1,9 +1,14 @@
 """The standard SOM."""
 import logging
-import json
 import numpy as np
 
+from tqdm import tqdm
 from .components.initializers import range_initialization
+from .components.influence import gaussian_influence
+from .components.utilities import grid_distance
+from .components.index import BmuIndex, BmuCache
+from .components.data import load_data
+from .components.serialization import read_model
 from collections import Counter, defaultdict
 from .base import Base
 
@@ -39,6 +44,14 @@ class BaseSom(Base):
     scaler : initialized Scaler instance
         An initialized instance of Scaler() which is used to scale the data
         to have mean 0 and stdev 1.
+    influence_epsilon : float, optional, default None
+        The smallest influence to take into account during training. If this
+        is set, the influence is truncated and stored sparsely as soon as
+        the neighborhood has become small enough, which makes updates in late
+        epochs much cheaper. If this is None, the influence is never
+        truncated.
+    dtype : numpy dtype, optional, default np.float64
+        The dtype of the weights, see Base.
 
     """
 
@@ -49,14 +62,18 @@ class BaseSom(Base):
                  argfunc,
                  valfunc,
                  initializer,
-                 scaler):
+                 scaler,
+                 influence_epsilon=None,
+                 dtype=np.float64):
         """Initialize your maps."""
         # A tuple of dimensions
         # Usually (width, height), but can accomodate N-dimensional maps.
         self.map_dimensions = map_dimensions
-        self.num_neurons = np.int(np.prod(self.map_dimensions))
-        # Initialize the distance grid: only needs to be done once.
-        self.distance_grid = self._initialize_distance_grid()
+        self.num_neurons = int(np.prod(self.map_dimensions))
+        # The distance grid is only initialized when it is needed, because
+        # it has size num_neurons * num_neurons.
+        self._distance_grid = None
+        self.influence_epsilon = influence_epsilon
 
         super().__init__(self.num_neurons,
                          data_dimensionality,
@@ -64,18 +81,26 @@ class BaseSom(Base):
                          'argmin',
                          'min',
                          initializer,
-                         scaler)
+                         scaler,
+                         dtype)
 
-    def _init_prev(self, x):
-        """Initialize recurrent SOMs."""
-        return None
+    @property
+    def distance_grid(self):
+        """The squared grid distance from each neuron to each other neuron."""
+        if self._distance_grid is None:
+            self._distance_grid = self._initialize_distance_grid()
+        return self._distance_grid
 
     def _calculate_influence(self, neighborhood):
         """
         Pre-calculate the influence for a given value of sigma.
 
-        The neighborhood has size num_neurons * num_neurons, so for a
-        30 * 30 map, the neighborhood will be size (900, 900).
+        Because the gaussian neighborhood factorizes over the axes of the
+        map, only a (width, width) kernel is calculated for each axis.
+        The (num_neurons, num_neurons) influence matrix is never created.
+
+        If influence_epsilon is set, the influence switches to a sparse,
+        truncated representation once the neighborhood has become small.
 
         Parameters
         ----------
@@ -84,51 +109,18 @@ class BaseSom(Base):
 
         Returns
         -------
-        neighborhood : numpy array
+        neighborhood : SeparableInfluence or SparseInfluence
             The influence from each neuron to each other neuron.
 
         """
-        grid = np.exp(-self.distance_grid / (neighborhood ** 2))
-        return grid.reshape(self.num_neurons, self.num_neurons)[:, :, None]
+        return gaussian_influence(self.map_dimensions,
+                                  neighborhood,
+                                  self.influence_epsilon,
+                                  dtype=self.dtype)
 
     def _initialize_distance_grid(self):
-        """Initialize the distance grid by calls to _grid_dist."""
-        p = [self._grid_distance(i) for i in range(self.num_neurons)]
-        return np.array(p)
-
-    def _grid_distance(self, index):
-        """
-        Calculate the distance grid for a single index position.
-
-        This is pre-calculated for fast neighborhood calculations
-        later on (see _calc_influence).
-        """
-        # Take every dimension but the first in reverse
-        # then reverse that list again.
-        dimensions = np.cumprod(self.map_dimensions[1::][::-1])[::-1]
-
-        coord = []
-        for idx, dim in enumerate(dimensions):
-            if idx != 0:
-                value = (index % dimensions[idx-1]) // dim
-            else:
-                value = index // dim
-            coord.append(value)
-
-        coord.append(index % self.map_dimensions[-1])
-
-        for idx, (width, row) in enumerate(zip(self.map_dimensions, coord)):
-            x = np.abs(np.arange(width) - row) ** 2
-            dims = self.map_dimensions[::-1]
-            if idx:
-                dims = dims[:-idx]
-            x = np.broadcast_to(x, dims).T
-            if idx == 0:
-                distance = np.copy(x)
-            else:
-                distance += x.T
-
-        return distance
+        """Initialize the distance grid, which is shared between maps."""
+        return grid_distance(tuple(self.map_dimensions))
 
     def topographic_error(self, X, batch_size=1):
         """
@@ -160,26 +152,26 @@ class BaseSom(Base):
         # Sort the distances and get the indices of the two smallest distances
         # for each datapoint.
         res = dist.argsort(1)[:, :2]
-        # Lookup the euclidean distance between these points in the distance
-        # grid
-        dgrid = self.distance_grid.reshape(self.num_neurons, self.num_neurons)
-        res = np.asarray([dgrid[x, y] for x, y in res])
+        # Calculate the squared grid distance between these points from
+        # their coordinates on the map.
+        first = np.unravel_index(res[:, 0], self.map_dimensions)
+        second = np.unravel_index(res[:, 1], self.map_dimensions)
+        res = np.sum([(x - y) ** 2 for x, y in zip(first, second)], 0)
         # Subtract 1.0 because 1.0 is the smallest distance.
         return np.sum(res > 1.0) / len(res)
 
     def neighbors(self, distance=2.0):
         """Get all neighbors for all neurons."""
-        dgrid = self.distance_grid.reshape(self.num_neurons, self.num_neurons)
-        for x, y in zip(*np.nonzero(dgrid <= distance)):
+        for x, y in zip(*np.nonzero(self.distance_grid <= distance)):
             if x != y:
                 yield x, y
 
     def neighbor_difference(self):
         """Get the euclidean distance between a node and its neighbors."""
-        differences = np.zeros(self.num_neurons)
-        num_neighbors = np.zeros(self.num_neurons)
+        differences = np.zeros(self.num_neurons, dtype=self.dtype)
+        num_neighbors = np.zeros(self.num_neurons, dtype=self.dtype)
 
-        distance, _ = self.distance_function(self.weights, self.weights)
+        distance = self.distance(self.weights, self.weights)
         for x, y in self.neighbors():
             differences[x] += distance[x, y]
             num_neighbors[x] += 1
@@ -204,12 +196,12 @@ class BaseSom(Base):
             The average distance from each neuron to each data point.
 
         """
-        distance, _ = self.distance_function(X, self.weights)
+        distance = self.distance(X, self.weights)
         dists_per_neuron = defaultdict(list)
         for x, y in zip(np.argmin(distance, 1), distance):
             dists_per_neuron[x].append(y[x])
 
-        out = np.zeros(self.num_neurons)
+        out = np.zeros(self.num_neurons, dtype=self.dtype)
         average_spread = {k: np.mean(v)
                           for k, v in dists_per_neuron.items()}
 
@@ -286,7 +278,7 @@ class BaseSom(Base):
 
         return rec
 
-    def invert_projection(self, X, identities):
+    def invert_projection(self, X, identities, use_index=False):
         """
         Calculate the inverted projection.
 
@@ -303,6 +295,10 @@ class BaseSom(Base):
         identities : list
             A list of names for each of the input data. Must be the same
             length as X.
+        use_index : bool, optional, default False
+            Whether to find the closest input for each neuron through an
+            index over the input data, instead of comparing each neuron to
+            all inputs.
 
         Returns
         -------
@@ -310,15 +306,20 @@ class BaseSom(Base):
             An array with the same shape as the map
 
         """
-        distances = self.transform(X)
-
-        if len(distances) != len(identities):
+        if len(X) != len(identities):
             raise ValueError("X and identities are not the same length: "
                              "{0} and {1}".format(len(X), len(identities)))
 
+        if use_index:
+            X = np.asarray(self._check_input(X), dtype=self.dtype)
+            matches = BmuIndex(X).query(self.weights)[0]
+        else:
+            distances = self.transform(X)
+            matches = distances.__getattribute__(self.argfunc)(0)
+
         node_match = []
 
-        for d in distances.__getattribute__(self.argfunc)(0):
+        for d in matches:
             node_match.append(identities[d])
 
         return np.array(node_match)
@@ -391,6 +392,12 @@ class Som(BaseSom):
     infl_lambda : float
         Controls the steepness of the exponential function that decreases
         the neighborhood.
+    influence_epsilon : float, optional, default None
+        The smallest influence to take into account during training. If this
+        is set, the influence is truncated and stored sparsely as soon as
+        the neighborhood has become small enough.
+    dtype : numpy dtype, optional, default np.float64
+        The dtype of the weights, influences and outputs.
 
     Attributes
     ----------
@@ -402,6 +409,11 @@ class Som(BaseSom):
     distance_grid : numpy array
         An array which contains the distance from each neuron to each
         other neuron.
+    mode : str
+        The training engine used in the last call to fit.
+    bmu_cache : BmuCache
+        The BMU of each training item during fit, if enabled. None outside
+        of fit.
 
     """
 
@@ -409,7 +421,12 @@ class Som(BaseSom):
     param_names = {'map_dimensions',
                    'weights',
                    'data_dimensionality',
-                   'params'}
+                   'params',
+                   'influence_epsilon',
+                   'dtype'}
+
+    # The available training engines.
+    modes = ("online", "batch")
 
     def __init__(self,
                  map_dimensions,
@@ -419,7 +436,9 @@ class Som(BaseSom):
                  initializer=range_initialization,
                  scaler=None,
                  lr_lambda=2.5,
-                 infl_lambda=2.5):
+                 infl_lambda=2.5,
+                 influence_epsilon=None,
+                 dtype=np.float64):
         """Organize your maps."""
         if influence is None:
             # Add small constant to sigma to prevent
@@ -441,17 +460,300 @@ class Som(BaseSom):
                          'argmin',
                          'min',
                          initializer,
-                         scaler)
+                         scaler,
+                         influence_epsilon,
+                         dtype)
+        self.mode = "online"
+        self.bmu_cache = None
+
+    def fit(self,
+            X,
+            num_epochs=10,
+            updates_epoch=None,
+            stop_param_updates=dict(),
+            batch_size=1,
+            show_progressbar=False,
+            show_epoch=False,
+            refit=True,
+            precompute_influence=False,
+            mode="online",
+            bmu_cache=False,
+            n_jobs=1,
+            checkpoint=None,
+            checkpoint_epochs=None,
+            checkpoint_seconds=None,
+            resume_from=None):
+        """
+        Fit the SOM to some data.
+
+        Parameters
+        ----------
+        X : numpy array, np.memmap, str or list of numpy arrays
+            The input data. See Base.fit for data which is not in memory.
+        num_epochs : int, optional, default 10
+            The number of epochs to train for.
+        updates_epoch : int, optional, default 10
+            The number of updates to perform on the learning rate and
+            neighborhood per epoch. 10 suffices for most problems.
+        stop_param_updates : dict
+            The epoch at which to stop updating each param. This means
+            that the specified parameter will be reduced to 0 at the specified
+            epoch.
+        batch_size : int, optional, default 100
+            The batch size to use. Warning: batching can change your
+            performance dramatically, depending on the task. In batch mode,
+            the batch size only determines how many items are compared to
+            the map at the same time, and can be set as high as memory allows.
+        show_progressbar : bool, optional, default False
+            Whether to show a progressbar during training.
+        show_epoch : bool, optional, default False
+            Whether to print the epoch number to stdout
+        precompute_influence : bool, optional, default False
+            Whether to calculate the influence for the entire neighborhood
+            schedule before training, as far as it fits in the influence
+            cache.
+        mode : str, optional, default "online"
+            The training engine to use. "online" uses the sequential or
+            mini-batch update rule, in which the weights are updated after
+            every batch. "batch" uses the Kohonen batch SOM, in which the
+            weights are set once per epoch to the influence-weighted mean of
+            all data.
+        bmu_cache : bool, optional, default False
+            Whether to remember the BMU of each item between epochs. If this
+            is True, items are first compared to the neighbors of their
+            previous BMU, and are only compared to all neurons if a bound
+            shows that the result might be wrong. This makes later epochs,
+            in which items rarely change BMU, much cheaper.
+        n_jobs : int, optional, default 1
+            The number of processes to use. If this is more than 1, each
+            batch, or in batch mode, all data, is divided over a pool of
+            processes which share the data and the weights. If this is -1,
+            all cores are used. Can not be combined with the BMU cache.
+        checkpoint : str, optional, default None
+            The path of a .npz file to which the state of training is
+            written at the end of an epoch. See Base.fit.
+        checkpoint_epochs : int, optional, default None
+            Write a checkpoint every checkpoint_epochs epochs.
+        checkpoint_seconds : float, optional, default None
+            Write a checkpoint at the end of the first epoch which ends
+            at least checkpoint_seconds after the previous checkpoint.
+        resume_from : str, optional, default None
+            The path of a checkpoint to resume training from. The mode
+            is not stored in the checkpoint, and should be passed again.
+
+        """
+        if mode not in self.modes:
+            raise ValueError("mode should be one of {0}, got "
+                             "{1}".format(self.modes, mode))
+        if bmu_cache and self.argfunc != 'argmin':
+            raise ValueError("The BMU cache can only be used for models of "
+                             "which the BMU is the closest neuron.")
+        if bmu_cache and n_jobs != 1:
+            raise ValueError("The BMU cache can only be used in a single "
+                             "process.")
+        self.mode = mode
+        X = load_data(X)
+        if bmu_cache:
+            self.bmu_cache = BmuCache(len(X), self.map_dimensions)
+
+        try:
+            super().fit(X,
+                        num_epochs,
+                        updates_epoch,
+                        stop_param_updates,
+                        batch_size,
+                        show_progressbar,
+                        show_epoch,
+                        refit,
+                        precompute_influence,
+                        n_jobs,
+                        checkpoint,
+                        checkpoint_epochs,
+                        checkpoint_seconds,
+                        resume_from)
+        finally:
+            self.bmu_cache = None
+
+    def _epoch(self,
+               X,
+               epoch_idx,
+               batch_size,
+               updates_epoch,
+               constants,
+               show_progressbar):
+        """Run a single epoch, using the engine selected by self.mode."""
+        if self.bmu_cache is not None:
+            self.bmu_cache.start_epoch(self.weights)
+
+        if self.mode == "batch":
+            self._batch_epoch(X,
+                              batch_size,
+                              updates_epoch,
+                              constants,
+                              show_progressbar)
+        else:
+            super()._epoch(X,
+                           epoch_idx,
+                           batch_size,
+                           updates_epoch,
+                           constants,
+                           show_progressbar)
+
+    def _batch_epoch(self,
+                     X,
+                     batch_size,
+                     updates_epoch,
+                     constants,
+                     show_progressbar):
+        """
+        Run a single epoch of the batch SOM.
+
+        First, the BMU of every item is found, which gives the number of
+        items assigned to each neuron, and the sum of these items.
+        The new weights are then set using a single product with the
+        influence matrix. The learning rate is part of both the
+        numerator and the denominator, and therefore cancels out.
+
+        The parameters are updated as often as in an online epoch with the
+        same batch_size, so both modes end with the same parameters.
+
+        Parameters
+        ----------
+        X : numpy array
+            The training data.
+        batch_size : int
+            The number of items to find the BMU for at the same time.
+        updates_epoch : int
+            The number of updates to perform per epoch
+        constants : dict
+            A dictionary containing the constants with which to update the
+            parameters in self.parameters.
+        show_progressbar : bool
+            Whether to show a progressbar during training.
+
+        """
+        # Apply all parameter updates of this epoch at once. The online
+        # epoch updates once at the start, and once every update_step
+        # batches, so the same number of updates is applied here.
+        num_batches = int(np.ceil(len(X) / batch_size))
+        update_step = np.ceil(num_batches / updates_epoch)
+        num_updates = 1 + int(np.ceil(num_batches / update_step))
+        influences = self._update_params({k: v ** num_updates
+                                          for k, v in constants.items()})
+        logger.info(self.params)
+
+        if self.parallel is not None:
+            counts, summed = self.parallel.batch_statistics(batch_size)
+        else:
+            counts, summed = self._batch_statistics(X,
+                                                    0,
+                                                    len(X),
+                                                    batch_size,
+                                                    show_progressbar)
+
+        weighted_x = influences.T.dot(summed)
+        total = influences.T.dot(counts)
+
+        # Neurons without any influence keep their weights.
+        mask = total > 0
+        self.weights[mask] = weighted_x[mask] / total[mask, None]
+
+    def _batch_statistics(self,
+                          X,
+                          start,
+                          stop,
+                          batch_size,
+                          show_progressbar=False):
+        """
+        Calculate the statistics of the batch SOM for part of the data.
+
+        Parameters
+        ----------
+        X : numpy array
+            The training data.
+        start : int
+            The index of the first item to use.
+        stop : int
+            The index after the last item to use.
+        batch_size : int
+            The number of items to find the BMU for at the same time.
+        show_progressbar : bool
+            Whether to show a progressbar.
+
+        Returns
+        -------
+        counts : numpy array
+            The number of items for which each neuron is the BMU.
+        summed : numpy array
+            The sum of the items for which each neuron is the BMU.
+
+        """
+        counts = np.zeros(self.num_neurons, dtype=self.dtype)
+        summed = np.zeros_like(self.weights)
+
+        for idx in tqdm(range(start, stop, batch_size),
+                        disable=not show_progressbar):
+            x = X[idx:min(idx+batch_size, stop)]
+            bmu = self._find_bmu(x, np.arange(idx, idx+len(x)))
+            counts += np.bincount(bmu, minlength=self.num_neurons)
+            # Sum the items of each BMU as contiguous blocks.
+            order = np.argsort(bmu, kind='stable')
+            neurons, starts = np.unique(bmu[order], return_index=True)
+            summed[neurons] += np.add.reduceat(x[order], starts)
+
+        return counts, summed
+
+    def _propagate(self, x, influences, **kwargs):
+        """Propagate a single batch of examples through the network."""
+        if self.bmu_cache is None:
+            return super()._propagate(x, influences, **kwargs)
+
+        bmu = self._find_bmu(x, kwargs['indices'])
+        neurons, update = self._calculate_update(x, influences, bmu)
+        self.weights[neurons] += update
+        self.bmu_cache.moved(neurons, self.weights)
+
+    def _find_bmu(self, x, indices):
+        """
+        Find the BMU of each item, using the BMU cache if it is enabled.
+
+        Parameters
+        ----------
+        x : numpy array
+            A batch of input data.
+        indices : numpy array
+            The index of each item in the training data.
+
+        Returns
+        -------
+        bmu : numpy array
+            The BMU of each item.
+
+        """
+        if self.bmu_cache is None:
+            return self._get_bmu(self.activate(x))
+
+        bmu = self.bmu_cache.query(x, indices, self.weights)
+        missing = bmu < 0
+        if np.any(missing):
+            distance = self.activate(x[missing])
+            bmu[missing] = self._get_bmu(distance)
+            self.bmu_cache.store(indices[missing], distance, bmu[missing])
+
+        return bmu
 
     @classmethod
-    def load(cls, path):
+    def load(cls, path, mmap=True):
         """
-        Load a SOM from a JSON file saved with this package..
+        Load a SOM from a file saved with this package.
 
         Parameters
         ----------
         path : str
-            The path to the JSON file.
+            The path to the JSON or .npz file.
+        mmap : bool, optional, default True
+            Whether to memory-map the arrays of a .npz file, instead of
+            reading them into memory.
 
         Returns
         -------
@@ -459,19 +761,24 @@ class Som(BaseSom):
             A som of the specified class.
 
         """
-        data = json.load(open(path))
+        data = read_model(path, mmap)
 
         weights = data['weights']
-        weights = np.asarray(weights, dtype=np.float64)
+        dtype = data.get('dtype', 'float64')
+        weights = np.asarray(weights, dtype=dtype)
 
         s = cls(data['map_dimensions'],
-                data['data_dimensionality'],
                 data['params']['lr']['orig'],
+                data_dimensionality=data['data_dimensionality'],
                 influence=data['params']['infl']['orig'],
                 lr_lambda=data['params']['lr']['factor'],
-                infl_lambda=data['params']['infl']['factor'])
+                infl_lambda=data['params']['infl']['factor'],
+                influence_epsilon=data.get('influence_epsilon'),
+                dtype=dtype)
 
         s.weights = weights
+        s.params = data['params']
         s.trained = True
+        s._load_scaler(data)
 
         return s
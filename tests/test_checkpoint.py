@@ -0,0 +1,68 @@
+"""Tests for resuming training from a checkpoint."""
+import numpy as np
+import pytest
+
+from somber import Som, Ng, RecursiveSom
+from somber.components.utilities import Scaler
+
+
+def _data(num_items=200, dim=3, seed=0):
+    """Create random training data."""
+    return np.random.RandomState(seed).rand(num_items, dim)
+
+
+def _create(cls):
+    """Create an untrained model of a kind."""
+    if cls is Ng:
+        return Ng(10, .3, influence=2, data_dimensionality=3)
+    if cls is RecursiveSom:
+        return RecursiveSom((3, 3), .3, 1., 1., 3)
+    return Som((4, 5), .3, 3, scaler=Scaler())
+
+
+@pytest.mark.parametrize("cls", [Som, Ng, RecursiveSom])
+def test_resume_matches_uninterrupted_run(tmp_path, cls):
+    """Resuming from a checkpoint gives the same result as a single fit."""
+    X = _data()
+    path = str(tmp_path / "checkpoint.npz")
+
+    np.random.seed(0)
+    uninterrupted = _create(cls)
+    uninterrupted.fit(X, num_epochs=4, batch_size=10)
+
+    # Interrupt training at the start of the third epoch, after which
+    # training is resumed by a new model.
+    np.random.seed(0)
+    model = _create(cls)
+    epoch = model._epoch
+
+    def interrupt(X, epoch_idx, *args):
+        if epoch_idx == 2:
+            raise KeyboardInterrupt
+        epoch(X, epoch_idx, *args)
+
+    model._epoch = interrupt
+    with pytest.raises(KeyboardInterrupt):
+        model.fit(X, num_epochs=4, batch_size=10, checkpoint=path)
+
+    # The schedule is taken from the checkpoint.
+    np.random.seed(1)
+    interrupted = _create(cls)
+    interrupted.fit(X,
+                    num_epochs=4,
+                    batch_size=10,
+                    updates_epoch=20,
+                    resume_from=path)
+
+    assert np.allclose(interrupted.weights, uninterrupted.weights)
+    if hasattr(uninterrupted, 'context_weights'):
+        assert np.allclose(interrupted.context_weights,
+                           uninterrupted.context_weights)
+    for k, v in uninterrupted.params.items():
+        assert np.isclose(interrupted.params[k]['value'], v['value'])
+
+
+def test_checkpoint_requires_npz(tmp_path):
+    """Checkpoints are only written in the binary format."""
+    with pytest.raises(ValueError):
+        _create(Som).fit(_data(), checkpoint=str(tmp_path / "model.json"))
@@ -0,0 +1,21 @@
+"""Tests for the BMU index."""
+import numpy as np
+
+from somber.components.distance import euclidean_distance
+from somber.components.index import BmuIndex
+
+
+def test_approximate_query_with_duplicate_points():
+    """Empty cells are never probed, so every query finds a point."""
+    rng = np.random.RandomState(0)
+    points = np.repeat(rng.rand(5, 3), 20, axis=0)
+    X = rng.rand(100, 3)
+
+    index = BmuIndex(points, num_cells=10, num_probe=1, exact=False,
+                     random_state=0)
+    bmu, distance = index.query(X)
+
+    assert np.all(np.isfinite(distance))
+    expected = euclidean_distance(X, points).min(1)
+    assert np.allclose(distance, expected)
+    assert np.allclose(np.linalg.norm(X - points[bmu], axis=1), expected)
@@ -0,0 +1,53 @@
+"""Tests for data-parallel training over multiple processes."""
+import numpy as np
+import pytest
+
+from somber import Som, Ng, RecursiveSom
+from somber.components.utilities import Scaler
+
+
+def _data(num_items=300, dim=3, seed=0):
+    """Create random training data."""
+    return np.random.RandomState(seed).rand(num_items, dim)
+
+
+def _create(cls):
+    """Create an untrained model of a kind."""
+    if cls is Ng:
+        return Ng(10, .3, influence=2, data_dimensionality=3)
+    return Som((4, 5), .3, 3, scaler=Scaler())
+
+
+@pytest.mark.parametrize("cls, mode", [(Som, "online"),
+                                       (Som, "batch"),
+                                       (Ng, None)])
+def test_parallel_matches_single_process(cls, mode):
+    """Training with n_jobs > 1 gives the same result as a single process."""
+    X = _data()
+    kwargs = {} if mode is None else {'mode': mode}
+
+    np.random.seed(0)
+    single = _create(cls)
+    single.fit(X, num_epochs=2, batch_size=20, **kwargs)
+
+    np.random.seed(0)
+    parallel = _create(cls)
+    parallel.fit(X, num_epochs=2, batch_size=20, n_jobs=3, **kwargs)
+
+    assert parallel.parallel is None
+    assert isinstance(parallel.weights, np.ndarray)
+    assert np.allclose(parallel.weights, single.weights)
+    for k, v in single.params.items():
+        assert np.isclose(parallel.params[k]['value'], v['value'])
+
+
+def test_batch_size_smaller_than_n_jobs():
+    """Each batch is divided over the processes."""
+    with pytest.raises(ValueError):
+        _create(Som).fit(_data(), num_epochs=1, batch_size=2, n_jobs=3)
+
+
+def test_sequential_models_can_not_train_in_parallel():
+    """The context depends on the previous item, so batches are in order."""
+    with pytest.raises(ValueError):
+        RecursiveSom((3, 3), .3, 1., 1., 3).fit(_data(), n_jobs=2)
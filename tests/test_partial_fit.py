@@ -0,0 +1,74 @@
+"""Tests for training on a stream of data with partial_fit."""
+import numpy as np
+import pytest
+
+from somber import Som, PLSom, RecursiveSom
+from somber.components.utilities import Scaler
+
+
+def _data(num_items=300, dim=3, seed=0):
+    """Create random training data."""
+    return np.random.RandomState(seed).rand(num_items, dim)
+
+
+def _fitted(cls):
+    """Create a model of a kind, trained on some warm-up data."""
+    if cls is PLSom:
+        model = PLSom((4, 5), 3, scaler=Scaler())
+    else:
+        model = Som((4, 5), .3, 3, scaler=Scaler())
+    np.random.seed(0)
+    model.fit(_data(seed=1), num_epochs=1, batch_size=10)
+    return model
+
+
+@pytest.mark.parametrize("cls", [Som, PLSom])
+def test_chunks_match_single_call(cls):
+    """Training on chunks gives the same result as a single call."""
+    X = _data()
+
+    single = _fitted(cls)
+    single.partial_fit(X, batch_size=10, num_updates=20)
+
+    chunked = _fitted(cls)
+    for start in range(0, len(X), 100):
+        chunked.partial_fit(X[start:start+100], batch_size=10, num_updates=20)
+
+    assert np.allclose(chunked.weights, single.weights)
+    for k, v in single.params.items():
+        assert np.isclose(chunked.params[k]['value'], v['value'])
+
+
+def test_first_call_initializes_model():
+    """The first call on an untrained model fits the scaler and weights."""
+    X = _data()
+    model = Som((4, 5), .3, scaler=Scaler())
+    model.partial_fit(X[:100], batch_size=10)
+
+    assert model.trained
+    assert model.data_dimensionality == 3
+    assert np.allclose(model.scaler.mean, X[:100].mean(0))
+    assert np.all(np.isfinite(model.weights))
+
+
+def test_fit_ends_stream():
+    """After fit, partial_fit starts from the weights of fit."""
+    X = _data()
+    streamed = _fitted(Som)
+    streamed.partial_fit(X[:100], batch_size=10)
+    np.random.seed(2)
+    streamed.fit(X, num_epochs=1, batch_size=10)
+    streamed.partial_fit(X[:20], batch_size=10, num_updates=2)
+
+    model = _fitted(Som)
+    np.random.seed(2)
+    model.fit(X, num_epochs=1, batch_size=10)
+    model.partial_fit(X[:20], batch_size=10, num_updates=2)
+
+    assert np.allclose(streamed.weights, model.weights)
+
+
+def test_sequential_models_can_not_partial_fit():
+    """The context of a stream can not be split over calls."""
+    with pytest.raises(ValueError):
+        RecursiveSom((3, 3), .3, 1., 1., 3).partial_fit(_data())
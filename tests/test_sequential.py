@@ -0,0 +1,49 @@
+"""Tests for the sequential models."""
+import numpy as np
+
+from somber import MergeSom
+from somber.components.utilities import Scaler
+
+
+def _isotropic_data(num_items=300, dim=3, std=2.0, seed=0):
+    """Create data of which every column has the same standard deviation."""
+    rng = np.random.RandomState(seed)
+    X = rng.randn(num_items, dim)
+    X = (X - X.mean(0)) / X.std(0)
+    return X * std + rng.uniform(-5, 5, dim)
+
+
+def test_merge_scaled_fit_matches_prescaled_fit():
+    """Training with a scaler is the same as training on scaled data."""
+    X = _isotropic_data()
+    X_scaled = Scaler().fit_transform(X)
+
+    np.random.seed(1)
+    scaled = MergeSom((5, 5), .3, .5, .5, 3, scaler=Scaler())
+    scaled.fit(X, num_epochs=3)
+
+    np.random.seed(1)
+    prescaled = MergeSom((5, 5), .3, .5, .5, 3)
+    prescaled.fit(X_scaled, num_epochs=3)
+
+    assert np.allclose(scaled.scaler.transform(scaled.context_weights),
+                       prescaled.context_weights,
+                       atol=1e-5)
+    assert np.array_equal(scaled.predict(X), prescaled.predict(X_scaled))
+
+
+def test_merge_reset_does_not_depend_on_activation():
+    """An activation which underflows to zero does not reset the context."""
+    X = _isotropic_data(num_items=50, std=100.0).astype(np.float32)
+    s = MergeSom((3, 3), .3, 1., 1., 3, dtype=np.float32)
+    s.fit(X, num_epochs=1)
+
+    prev = np.zeros((2, s.num_neurons), dtype=np.float32)
+    context = s._context(prev, reset=np.array([True, False]))
+    expected = (1 - s.merge) * s.weights[0] + s.merge * s.context_weights[0]
+
+    assert np.array_equal(context[0], np.zeros(3, dtype=np.float32))
+    assert np.allclose(context[1], expected)
+
+    session = s.session()
+    assert np.array_equal(session.run(X), s.predict(X))
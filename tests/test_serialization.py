@@ -0,0 +1,62 @@
+"""Tests for saving and loading models."""
+import numpy as np
+import pytest
+
+from somber import Som, PLSom, Ng, RecursiveSom, MergeSom
+from somber.components.utilities import Scaler
+
+
+def _data(num_items=200, dim=3, seed=0):
+    """Create random training data."""
+    return np.random.RandomState(seed).rand(num_items, dim)
+
+
+def _models():
+    """Create a trained model of each kind."""
+    X = _data()
+    np.random.seed(0)
+    models = [Som((4, 5), .3, 3, scaler=Scaler(), dtype=np.float32),
+              PLSom((4, 5), 3),
+              Ng(10, .3, influence=2, data_dimensionality=3),
+              RecursiveSom((3, 3), .3, 1., 1., 3),
+              MergeSom((3, 3), .3, .5, .5, 3, scaler=Scaler(), merge=.3)]
+    for model in models:
+        model.fit(X, num_epochs=2)
+    return models
+
+
+@pytest.mark.parametrize("extension", [".json", ".npz"])
+@pytest.mark.parametrize("mmap", [True, False])
+def test_round_trip(tmp_path, extension, mmap):
+    """A loaded model has the same state and predictions as the saved one."""
+    X = _data(seed=1)
+    for model in _models():
+        path = str(tmp_path / (type(model).__name__ + extension))
+        model.save(path)
+        loaded = type(model).load(path, mmap=mmap)
+
+        assert loaded.dtype == model.dtype
+        assert loaded.weights.dtype == model.dtype
+        assert np.array_equal(loaded.weights, model.weights)
+        assert loaded.params == model.params
+        if hasattr(model, 'context_weights'):
+            assert np.array_equal(loaded.context_weights,
+                                  model.context_weights)
+        if model.scaler is not None:
+            assert np.array_equal(loaded.scaler.mean, model.scaler.mean)
+            assert np.array_equal(loaded.scaler.std, model.scaler.std)
+        assert np.array_equal(loaded.predict(X), model.predict(X))
+
+
+def test_save_over_memory_mapped_model(tmp_path):
+    """A memory-mapped model can be saved to the path it was loaded from."""
+    path = str(tmp_path / "som.npz")
+    model = _models()[0]
+    model.save(path)
+
+    loaded = Som.load(path, mmap=True)
+    loaded.weights[0] += 1
+    loaded.save(path)
+
+    assert np.array_equal(Som.load(path, mmap=False).weights,
+                          loaded.weights)